@@ -1,12 +1,13 @@
 import asyncio
 from dotenv import load_dotenv
 from os import getenv
-import pandas as pd
 # Initialize logger:
 import logging
 import json
+import html
+import signal
+import time
 logging.basicConfig(level=logging.INFO)
-from redis import Redis
 from datetime import datetime
 
 from aiogram import Bot, Dispatcher, types, F
@@ -15,11 +16,14 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message
 from aiogram import BaseMiddleware
 from aiogram.filters import BaseFilter
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types.keyboard_button import KeyboardButton
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from kvira_space_bot_src.spreadsheets.data import (
     WorkingMembership,
+    Punches,
     Lang,
 )
 
@@ -27,33 +31,57 @@ from kvira_space_bot_src.spreadsheets.api import (
     Lang,
     find_working_membership,
     get_days_left_from_membership,
-    get_user_data_pandas,
-    punch_user_day,
-    process_punches_from_string,
-    get_all_text_json,
-    activate_membership,
+    get_snapshot_membership,
 )
+from kvira_space_bot_src.spreadsheets import async_api
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from kvira_space_bot_src.executor import shutdown_executor
 from kvira_space_bot_src.redis_tools import (
-    init_redis,
+    close_redis,
     get_user_from_redis,
     add_user_to_redis,
+    update_user_lang_in_redis,
+    read_check_in_marks,
+    save_activation_mark,
+    save_punch_mark,
+    publish_cache_update,
+    CACHE_MEMBERSHIPS,
     TelegramUser,
-    add_chat_to_redis_list,
-    read_chats_from_redis_list,
-    ADMIN_CHATS_KEY,
-    save_json_to_redis,
-    TEXT_SAVED_KEY
 )
 from kvira_space_bot_src.messaging import (
-    send_message_to_admins,
+    notify_admins,
+    wait_admin_notifications,
+    get_admin_chats,
+    add_admin_chat,
     send_message_to_user,
     get_message_for_user,
     check_membership,
+    publish_text_catalog,
+    cache_updates_listener,
     )
 
-from asyncio import Lock
-
-table_push_lock = Lock()
+from kvira_space_bot_src.locks import row_lock, LockNotAcquired
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.membership_store import (
+    get_membership,
+    record_activation,
+    record_punch,
+    membership_sync_loop,
+    sync_memberships,
+)
+from kvira_space_bot_src.startup import (
+    startup_phase,
+    restore_last_known_state,
+    refresh_from_sheets,
+    local_snapshot_loop,
+    save_local_snapshot_now,
+)
+from kvira_space_bot_src.broadcast import (
+    start_broadcast,
+    resume_broadcast,
+    broadcast_resume_loop,
+    get_broadcast_state,
+)
 
 buttons = {
     Lang.Rus.value: {
@@ -78,11 +106,83 @@ ADMIN_LOG_MSG_TXT = "Kvira bot admin update:"
 # (0 = Monday, 1 = Tuesday, ..., 2 = Wednesday, ..., 6 = Sunday)
 COMMUNITY_DAY = 2
 
+# 'polling' or 'webhook'
+BOT_MODE = getenv('BOT_MODE', 'polling')
+# Public https address Telegram sends the updates to, without the path
+WEBHOOK_URL = getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(getenv('WEBHOOK_PORT', 8080))
+# Checked against the X-Telegram-Bot-Api-Secret-Token header of every request
+WEBHOOK_SECRET = getenv('WEBHOOK_SECRET') or None
+# With several replicas behind a load balancer only the last one
+# going down should remove the webhook, set to 0 there.
+WEBHOOK_DELETE_ON_SHUTDOWN = getenv('WEBHOOK_DELETE_ON_SHUTDOWN', '1') == '1'
+
 if admin_ids_users:
     if "," in admin_ids_users:
         admin_ids_users = admin_ids_users.split(",")
     else:
         admin_ids_users = [admin_ids_users]
+
+# Longest /metrics answer, Telegram messages are limited to 4096 characters
+METRICS_MESSAGE_LIMIT = 4000
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Counts the Redis round trips made while handling each update."""
+
+    async def __call__(self, handler, event, data):
+        with metrics.track_update_redis_calls():
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Measures the latency of every message handler, labelled by its name."""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        try:
+            with metrics.handler_latency.time(handler=name):
+                return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(handler=name)
+            raise
+
+
+async def get_or_create_user(from_user: types.User) -> TelegramUser:
+    """Profile of the Telegram user, created with the default language on first contact."""
+    user = await get_user_from_redis(from_user.id)
+    if user is None:
+        user = TelegramUser(
+            user_id=str(from_user.id),
+            username=str(from_user.username),
+            lang=Lang.Rus
+        )
+        await add_user_to_redis(user=user)
+        logging.info(f"Username {from_user.username} added to the Reddis")
+    return user
+
+
+class UserMiddleware(BaseMiddleware):
+    """Loads or creates the profile of the sender once per message
+    and passes it to the handlers as `user`. Messages without a sender
+    or sent by a bot are dropped, the handlers need a profile.
+    """
+
+    async def __call__(self, handler, event, data):
+        if event.from_user is None or event.from_user.is_bot:
+            logging.debug(f"Message {event.message_id} in chat {event.chat.id} has no user sender, skipped")
+            return None
+        data['user'] = await get_or_create_user(event.from_user)
+        return await handler(event, data)
+
+
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+dp.message.outer_middleware(UserMiddleware())
+dp.message.middleware(HandlerMetricsMiddleware())
+
+
 class IsAdmin(BaseFilter):
     """Check if the user is an admin. Works with user ids and usernames.
     """
@@ -96,16 +196,8 @@ class IsAdmin(BaseFilter):
             await message.answer("You are not privileged to use this command.")
         return is_admin
 
-def get_keyboard(user_id, redis: Redis | None=None):
-    """Get inline keyboard"""
-
-    user = get_user_from_redis(user_id)
-    
-    if user is not None:
-        lang = user.lang
-    else:
-        lang = Lang.Rus
-    
+def build_keyboard(lang: Lang) -> types.ReplyKeyboardMarkup:
+    """Reply keyboard with the buttons in the given language."""
     keyboard_buttons = [
         [
             KeyboardButton(text=buttons[lang.value]["check_membership"]),
@@ -113,19 +205,55 @@ def get_keyboard(user_id, redis: Redis | None=None):
             KeyboardButton(text=buttons[lang.value]["lang"]),
             ]
     ]
-    keyboard = types.ReplyKeyboardMarkup(
+    return types.ReplyKeyboardMarkup(
         keyboard=keyboard_buttons,
         resize_keyboard=True,
         input_field_placeholder="ТЫК"
     )
-    return keyboard
+
+# Built once, the markups are the same for every user of a language
+KEYBOARDS = {lang: build_keyboard(lang) for lang in Lang}
+
+def get_keyboard(lang: Lang) -> types.ReplyKeyboardMarkup:
+    """Get the reply keyboard for the language"""
+    return KEYBOARDS[lang]
+
+
+def build_webhook_app(bot: Bot) -> web.Application:
+    """aiohttp application receiving the updates on WEBHOOK_PATH.
+    Every update is handled in its own task and Telegram gets the answer at once,
+    so requests are processed concurrently.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    if metrics.METRICS_PORT == WEBHOOK_PORT:
+        metrics.add_metrics_route(app)
+    return app
 
 
 async def redis_loop():
-    '''This loop is needed to execute the Redis commands pereopdically.'''
-    init_redis()
-    while True:
-        await asyncio.sleep(1200)
+    '''Keeps the memberships in Redis in sync with the Google Sheet.
+    Redis is not checked upfront, it may not be ready yet: failed syncs are
+    retried by the loop and the pools replace broken connections.
+    '''
+    await membership_sync_loop()
+
+
+async def find_membership(username: str) -> WorkingMembership:
+    """Working membership of the user from the Redis store,
+    from the users sheet if the store is stale.
+    """
+    membership = await get_membership(username)
+    if membership is None:
+        users_snapshot = await async_api.get_users_snapshot()
+        membership = find_working_membership(username, users_snapshot.rows, index=users_snapshot.index)
+    return membership
                                     
 class TelegramApiBot:
 
@@ -134,49 +262,94 @@ class TelegramApiBot:
         logging.info(f"Inited bot with token!")
         self.admin_ids_users = admin_ids_users
         logging.info(f"Admins: {self.admin_ids_users}")
-        
-        # Here I cache all the messages from the Google Sheet
-        # To redis database
-        all_msgs = get_all_text_json()
-        save_json_to_redis(all_msgs, TEXT_SAVED_KEY)
-        logging.info("Messages saved to the Redis database")
+        # Texts and memberships are loaded in run_tasks, without waiting for Google
 
     async def _run(self):
         self._bot = bot
-        await dp.start_polling(self._bot)
+        if BOT_MODE == 'webhook':
+            await self._run_webhook()
+        else:
+            # getUpdates does not work while a webhook is set
+            await self._bot.delete_webhook()
+            await dp.start_polling(self._bot)
+
+    async def _run_webhook(self):
+        """Serve the webhook until SIGINT or SIGTERM."""
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE is webhook")
+        runner = web.AppRunner(build_webhook_app(self._bot))
+        await runner.setup()
+        await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await self._bot.set_webhook(
+                f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logging.info(f"Webhook is served on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            await stop.wait()
+        finally:
+            if WEBHOOK_DELETE_ON_SHUTDOWN:
+                await self._bot.delete_webhook()
+            await runner.cleanup()
 
     async def run_tasks(self):
-        database_loop = asyncio.create_task(redis_loop())
-        bot_loop = asyncio.create_task(self._run())
-        await asyncio.gather(database_loop, bot_loop)
+        started_at = time.monotonic()
+        # Serve the last known texts and memberships, fresh ones are pulled in the background
+        await restore_last_known_state()
+        with startup_phase('resume_broadcast'):
+            try:
+                await resume_broadcast(bot)
+            except Exception as e:
+                logging.error(f"Broadcast can not be resumed: {e}")
+        with startup_phase('metrics_server'):
+            if BOT_MODE == 'webhook' and metrics.METRICS_PORT == WEBHOOK_PORT:
+                # Served by the webhook application
+                metrics_runner = None
+            else:
+                metrics_runner = await metrics.start_metrics_server()
+        # Not cancelled on shutdown, a cancelled flush would leave writes behind
+        write_queue_task = asyncio.create_task(write_queue.run())
+        background_tasks = [
+            asyncio.create_task(redis_loop()),
+            asyncio.create_task(cache_updates_listener()),
+            asyncio.create_task(refresh_from_sheets()),
+            asyncio.create_task(local_snapshot_loop()),
+            asyncio.create_task(broadcast_resume_loop(bot)),
+        ]
+        metrics.startup_phase_seconds.set(time.monotonic() - started_at, phase='total')
+        logging.info(f"Startup done in {time.monotonic() - started_at:.3f}s, starting {BOT_MODE}")
+        try:
+            await self._run()
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            # Queued punches and activations must reach the sheet before exit
+            await write_queue.stop()
+            await save_local_snapshot_now()
+            await wait_admin_notifications()
+            shutdown_executor()
+            await close_redis()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
 
     def run(self):
         asyncio.run(self.run_tasks())
 
     # User handler zone
     @dp.message(CommandStart())
-    async def command_start_handler(message: Message) -> None:
+    async def command_start_handler(message: Message, user: TelegramUser) -> None:
         """This handler receives messages with `/start` command
         """
-        redis = init_redis()
-        user = get_user_from_redis(message.from_user.id)
-
-        if user is None:
-            user=TelegramUser(
-                user_id=str(message.from_user.id),
-                username=str(message.from_user.username),
-                lang=Lang.Rus
-            )
-            add_user_to_redis(user=user)
-
-            logging.info(f"Username {message.from_user.username} added to the Reddis")
-
-        users_memberships: pd.DataFrame = get_user_data_pandas()
-        membership = find_working_membership(user.username, users_memberships)
+        membership = await find_membership(user.username)
         # Process error messages
         if len(membership.errors) > 0:
             for error in membership.errors:
-                await send_message_to_admins(f"{ADMIN_LOG_MSG_TXT} Error in validation for user {user.username}: {error}", bot=bot)
+                notify_admins(f"{ADMIN_LOG_MSG_TXT} Error in validation for user {user.username}: {error}", bot=bot)
         hello_msg = get_message_for_user('hello_msg', user.lang)
         messages = [hello_msg]
         messages.extend(check_membership(user, membership))
@@ -185,112 +358,131 @@ class TelegramApiBot:
         if current_date.weekday() == COMMUNITY_DAY:
             messages.append(get_message_for_user('community_day', user.lang))
         logging.info(f"Messages for user {user.username}: {messages}")
-        await message.answer("\n".join(messages), reply_markup=get_keyboard(user.user_id))
+        await message.answer("\n".join(messages), reply_markup=get_keyboard(user.lang))
 
     # Process the user's choice. Language change is handled here.
-    @dp.message(F.text == buttons[Lang.Rus.value]["lang"] or F.text == buttons[Lang.Eng.value]["lang"])
-    async def lang_change_handler(message: Message):
-        user = get_user_from_redis(message.from_user.id)
-        if user is None:
-            user=TelegramUser(
-                user_id=str(message.from_user.id),
-                username=str(message.from_user.username),
-                lang=Lang.Rus
-            )
-            add_user_to_redis(user=user)
-            logging.info(f"Username {message.from_user.username} added to the Reddis")
-        
-        if user.lang == Lang.Rus:
-            user.lang = Lang.Eng
-        else:
-            user.lang = Lang.Rus
-    
-        add_user_to_redis(user) 
-        await message.answer(get_message_for_user('lang_changed', user.lang), reply_markup=get_keyboard(user.user_id))
-
-
-    @dp.message((F.text == buttons[Lang.Rus.value]["check_membership"]) or (F.text == buttons[Lang.Eng.value]["check_membership"]) or F.text == "Check membership")
-    async def check_membership_handler(message: Message):
-        user = get_user_from_redis(message.from_user.id)
-        if user is None:
-            user=TelegramUser(
-                user_id=str(message.from_user.id),
-                username=str(message.from_user.username),
-                lang=Lang.Rus
-            )
-            add_user_to_redis(user=user)
-            logging.info(f"Username {message.from_user.username} added to the Reddis")
-        users_memberships: pd.DataFrame = get_user_data_pandas()
-        membership = find_working_membership(user.username, users_memberships)
+    @dp.message(F.text.in_({buttons[Lang.Rus.value]["lang"], buttons[Lang.Eng.value]["lang"]}))
+    async def lang_change_handler(message: Message, user: TelegramUser):
+        lang = Lang.Eng if user.lang == Lang.Rus else Lang.Rus
+        user = await update_user_lang_in_redis(user.user_id, lang)
+        await message.answer(get_message_for_user('lang_changed', user.lang), reply_markup=get_keyboard(user.lang))
+
+
+    @dp.message(F.text.in_({buttons[Lang.Rus.value]["check_membership"], buttons[Lang.Eng.value]["check_membership"]}))
+    async def check_membership_handler(message: Message, user: TelegramUser):
+        membership = await find_membership(user.username)
         messages = check_membership(user, membership)
-        await message.answer("\n".join(messages), reply_markup=get_keyboard(user.user_id))
+        await message.answer("\n".join(messages), reply_markup=get_keyboard(user.lang))
 
 
-    @dp.message(F.text == buttons[Lang.Rus.value]["check_in"] or F.text == buttons[Lang.Eng.value]["check_in"])
-    async def check_in_handler(message: Message):
+    @dp.message(F.text.in_({buttons[Lang.Rus.value]["check_in"], buttons[Lang.Eng.value]["check_in"]}))
+    async def check_in_handler(message: Message, user: TelegramUser):
         # Get the current date
         current_date = datetime.now()
-        
-        user = get_user_from_redis(message.from_user.id)
-        if user is None:
-            user=TelegramUser(
-                user_id=str(message.from_user.id),
-                username=str(message.from_user.username),
-                lang=Lang.Rus
-            )
-            add_user_to_redis(user=user)
-            logging.info(f"Username {message.from_user.username} added to the Reddis")
+
         msg = None
-        users_memberships: pd.DataFrame = get_user_data_pandas()
-        membership = find_working_membership(user.username, users_memberships)
-        if current_date.weekday() != COMMUNITY_DAY:
-            # Activate the pass if it is not activated if it is NOT a community day
-            if membership.activated is False:
-                activate_membership(membership)
-                membership.activated = True
-                user_id = message.from_user.id
-                text = get_message_for_user('pass_activated', user.lang)
-                await send_message_to_user(user_id, text, bot=bot)
-                # Notify admins
-                await send_message_to_admins(f"{ADMIN_LOG_MSG_TXT} User {user.username} activated the pass", bot=bot)
-        # if community_day
+        membership = await find_membership(user.username)
         # Check if the current day is Wednesday (0 = Monday, 1 = Tuesday, ..., 2 = Wednesday, ..., 6 = Sunday)
         if current_date.weekday() == COMMUNITY_DAY:
             msg = 'community_day'
         elif membership.row_id is None:
             msg = 'no_pass'
         else:
-            await table_push_lock.acquire()
+            # Check-ins of different members run concurrently,
+            # taps of the same member wait for each other, on all workers.
+            today = current_date.strftime('%d.%m.%Y')
             try:
-                # If last punch was today, do nothing
-                if len(membership.membership_data['punches']) > 0:
-                    last_punch = process_punches_from_string(membership.membership_data['punches'])[-1]
-                else:
-                    last_punch = None
-                today = current_date.strftime('%d.%m.%Y')
-                # logging.info(f"Last punch: {last_punch}, today: {today}, {last_punch == today}")
-                if last_punch != None and last_punch == today:
-                    msg = 'already_punched'
-                else:
-                    ret_code = punch_user_day(membership.row_id)
-                    if ret_code:
-                        await send_message_to_admins(f"{ADMIN_LOG_MSG_TXT} User {user.username} punched the pass", bot=bot)
+                async with row_lock(membership.row_id):
+                    # Take the row again, a previous tap could have changed it meanwhile
+                    current_membership = await get_membership(user.username)
+                    if current_membership is None or current_membership.row_id != membership.row_id:
+                        current_membership = get_snapshot_membership(membership.row_id)
+                    if current_membership is not None:
+                        membership = current_membership
+                    # Other workers' check-ins may not be in our copy of the sheet yet
+                    activated_elsewhere, punched_elsewhere = await read_check_in_marks(user.username, membership.row_id, today)
+                    # Activate the pass if it is not activated if it is NOT a community day
+                    if membership.activated is False and not activated_elsewhere:
+                        write_queue.activate(membership.row_id, membership.membership_data['tg_nickname'], today)
+                        await save_activation_mark(user.username, membership.row_id)
+                        await record_activation(user.username, today)
+                        membership.activated = True
+                        user_id = message.from_user.id
+                        text = get_message_for_user('pass_activated', user.lang)
+                        await send_message_to_user(user_id, text, bot=bot)
+                        # Notify admins
+                        notify_admins(f"{ADMIN_LOG_MSG_TXT} User {user.username} activated the pass", bot=bot)
+                    # If the pass was punched today, do nothing
+                    punches = membership.punches or Punches.from_string(membership.membership_data['punches'])
+                    if punches.has_day(current_date.date()) or punched_elsewhere:
+                        msg = 'already_punched'
+                    else:
+                        # Failed flushes are retried by the queue, the punch is not lost
+                        write_queue.punch(membership.row_id, membership.membership_data['tg_nickname'], today)
+                        await save_punch_mark(user.username, today)
+                        await record_punch(user.username, punches.with_day(today))
+                        notify_admins(f"{ADMIN_LOG_MSG_TXT} User {user.username} punched the pass", bot=bot)
                         logging.info(f"User {user.username} punched the pass")
                         msg = 'pass_punched'
-                    else:
-                        logging.error(f"Error while punching the pass for user {user.username}")
-                        msg = "error_punching"
-            finally:
-                table_push_lock.release()
-        await message.answer(get_message_for_user(msg, user.lang), reply_markup=get_keyboard(user.user_id))
+            except LockNotAcquired:
+                logging.error(f"Check-in of {user.username} gave up waiting for row {membership.row_id}")
+                msg = "error_punching"
+        await message.answer(get_message_for_user(msg, user.lang), reply_markup=get_keyboard(user.lang))
 
 
     @dp.message(Command("admin"), IsAdmin(admin_ids_users))
     async def admin_command_handler(message: Message):
-        admin_chats = read_chats_from_redis_list(ADMIN_CHATS_KEY)
+        admin_chats = await get_admin_chats()
         if message.chat.id not in admin_chats:
-            add_chat_to_redis_list(message.chat.id, ADMIN_CHATS_KEY)
-            admin_chats.append(message.chat.id)
+            await add_admin_chat(message.chat.id)
             await message.answer(f"Chat {message.chat.id} added to the admin list!")
         else:
-            await message.answer("You are already in admin list!")
\ No newline at end of file
+            await message.answer("You are already in admin list!")
+
+    @dp.message(Command("refresh"), IsAdmin(admin_ids_users))
+    async def refresh_command_handler(message: Message):
+        """Force reload of the memberships sheet cache and the Redis store."""
+        await write_queue.flush()
+        if not await sync_memberships(full=True):
+            # Another worker is syncing the store right now
+            await async_api.get_users_snapshot(force_refresh=True)
+        users_snapshot = await async_api.get_users_snapshot()
+        await publish_cache_update(CACHE_MEMBERSHIPS)
+        await message.answer(f"Memberships reloaded: {len(users_snapshot.rows)} rows.")
+
+
+    @dp.message(Command("reload_texts"), IsAdmin(admin_ids_users))
+    async def reload_texts_command_handler(message: Message):
+        """Pull the texts from the Google Sheet and push them to all workers."""
+        all_msgs = await async_api.get_all_text_json(fresh=True)
+        version = await publish_text_catalog(all_msgs)
+        await message.answer(f"Texts reloaded: {len(all_msgs)} messages, version {version}.")
+
+
+    @dp.message(Command("broadcast"), IsAdmin(admin_ids_users))
+    async def broadcast_command_handler(message: Message, command: CommandObject):
+        """Send the text after the command to every user of the bot."""
+        if not command.args:
+            await message.answer("Usage: /broadcast <text>")
+            return
+        broadcast_id = await start_broadcast(command.args, bot)
+        if broadcast_id is None:
+            await message.answer("Another broadcast is still running, see /broadcast_status.")
+        else:
+            await message.answer(f"Broadcast {broadcast_id} started.")
+
+
+    @dp.message(Command("broadcast_status"), IsAdmin(admin_ids_users))
+    async def broadcast_status_command_handler(message: Message):
+        state = await get_broadcast_state()
+        if not state:
+            await message.answer("No broadcasts yet.")
+            return
+        await message.answer(f"Broadcast {state['id']}: {state['status']}, {state['sent']} sent, {state['failed']} failed.")
+
+
+    @dp.message(Command("metrics"), IsAdmin(admin_ids_users))
+    async def metrics_command_handler(message: Message):
+        """Short digest of the metrics, the full set is on the metrics endpoint."""
+        summary = metrics.summary()[:METRICS_MESSAGE_LIMIT]
+        await message.answer(f"<pre>{html.escape(summary)}</pre>")
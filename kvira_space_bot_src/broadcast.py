@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from aiogram import Bot
+
+from kvira_space_bot_src.locks import LockNotAcquired, RedisLock
+from kvira_space_bot_src.messaging import send_message_to_user
+from kvira_space_bot_src.redis_tools import (
+    BROADCAST_KEY,
+    get_redis_service_db,
+    scan_users,
+)
+
+# Users fetched from Redis per MGET and checkpointed together
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', 200))
+# Telegram calls in flight at the same time, the global rate limit still applies
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 10))
+
+# The broadcast state lives in the BROADCAST_KEY hash:
+# id, text, status (running / done), started_at, sent, failed.
+# Users that were already handled are kept in a set per broadcast,
+# so a restarted worker resumes the delivery instead of starting over.
+# Only the worker holding the broadcast lock delivers, the lease is renewed
+# after every batch and runs out if that worker dies. Every worker looks for
+# a running broadcast nobody delivers each BROADCAST_LOCK_LEASE seconds.
+BROADCAST_LOCK_LEASE = 60
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+
+_broadcast_task: asyncio.Task | None = None
+
+
+def _done_users_key(broadcast_id: str) -> str:
+    return f"{BROADCAST_KEY}:{broadcast_id}:done"
+
+
+async def get_broadcast_state() -> dict:
+    """Get the state of the last broadcast, empty dict if there was none.
+    """
+    state = await get_redis_service_db().hgetall(BROADCAST_KEY)
+    return {key.decode('utf-8'): value.decode('utf-8') for key, value in state.items()}
+
+
+async def _send_batch(broadcast_id: str, text: str, user_ids: list[str], bot: Bot, semaphore: asyncio.Semaphore) -> None:
+    async def send(user_id: str) -> bool:
+        async with semaphore:
+            return await send_message_to_user(int(user_id), text, bot)
+
+    results = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+    sent = sum(results)
+    # Checkpoint the batch, failed users are not retried either
+    redis = get_redis_service_db()
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.sadd(_done_users_key(broadcast_id), *user_ids)
+        pipe.hincrby(BROADCAST_KEY, 'sent', sent)
+        pipe.hincrby(BROADCAST_KEY, 'failed', len(user_ids) - sent)
+        await pipe.execute()
+
+
+async def run_broadcast(broadcast_id: str, text: str, bot: Bot) -> None:
+    """Deliver the broadcast to every user that did not get it yet.
+    Does nothing if another worker is delivering it already.
+    """
+    lock = RedisLock('broadcast', lease=BROADCAST_LOCK_LEASE)
+    if not await lock.try_acquire():
+        logging.debug(f"Broadcast {broadcast_id} is delivered by another worker")
+        return
+    redis = get_redis_service_db()
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    done_key = _done_users_key(broadcast_id)
+    try:
+        # The state was read before the lock, the broadcast may have finished meanwhile
+        state = await get_broadcast_state()
+        if state.get('id') != broadcast_id or state.get('status') != STATUS_RUNNING:
+            logging.info(f"Broadcast {broadcast_id} is not running anymore")
+            return
+        async for users in scan_users(BROADCAST_BATCH_SIZE):
+            if not users:
+                continue
+            user_ids = [user.user_id for user in users]
+            already_done = await redis.smismember(done_key, user_ids)
+            user_ids = [user_id for user_id, done in zip(user_ids, already_done) if not done]
+            if user_ids:
+                await _send_batch(broadcast_id, text, user_ids, bot, semaphore)
+            if not await lock.extend():
+                raise RuntimeError(f"Broadcast {broadcast_id} lost its lock")
+        await redis.hset(BROADCAST_KEY, 'status', STATUS_DONE)
+        await redis.delete(done_key)
+    finally:
+        await lock.release()
+    state = await get_broadcast_state()
+    logging.info(f"Broadcast {broadcast_id} finished: {state.get('sent')} sent, {state.get('failed')} failed")
+
+
+def _log_broadcast_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Broadcast stopped, it is resumed in {BROADCAST_LOCK_LEASE}s: {task.exception()}")
+
+
+def _spawn(broadcast_id: str, text: str, bot: Bot) -> None:
+    global _broadcast_task
+    _broadcast_task = asyncio.create_task(run_broadcast(broadcast_id, text, bot))
+    _broadcast_task.add_done_callback(_log_broadcast_failure)
+
+
+async def start_broadcast(text: str, bot: Bot) -> str | None:
+    """Start delivering the text to all users in the background.
+    Returns the broadcast id, None if another broadcast is still running.
+    """
+    # Admins on different workers must not start two broadcasts at once
+    try:
+        async with RedisLock('broadcast_start'):
+            state = await get_broadcast_state()
+            if state.get('status') == STATUS_RUNNING:
+                return None
+            broadcast_id = uuid.uuid4().hex[:8]
+            redis = get_redis_service_db()
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(BROADCAST_KEY)
+                pipe.hset(BROADCAST_KEY, mapping={
+                    'id': broadcast_id,
+                    'text': text,
+                    'status': STATUS_RUNNING,
+                    'started_at': int(time.time()),
+                    'sent': 0,
+                    'failed': 0,
+                })
+                await pipe.execute()
+    except LockNotAcquired:
+        return None
+    _spawn(broadcast_id, text, bot)
+    logging.info(f"Broadcast {broadcast_id} started")
+    return broadcast_id
+
+
+async def resume_broadcast(bot: Bot) -> None:
+    """Continue an unfinished broadcast after a restart or a crash of the worker delivering it.
+    """
+    state = await get_broadcast_state()
+    if state.get('status') == STATUS_RUNNING and (_broadcast_task is None or _broadcast_task.done()):
+        logging.info(f"Resuming broadcast {state['id']}, {state.get('sent')} already sent")
+        _spawn(state['id'], state['text'], bot)
+
+
+async def broadcast_resume_loop(bot: Bot) -> None:
+    """Resume a running broadcast every BROADCAST_LOCK_LEASE seconds,
+    it only goes on if the worker delivering it is gone.
+    """
+    while True:
+        await asyncio.sleep(BROADCAST_LOCK_LEASE)
+        try:
+            await resume_broadcast(bot)
+        except Exception as e:
+            logging.error(f"Broadcast can not be resumed: {e}")
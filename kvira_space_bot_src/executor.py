@@ -0,0 +1,52 @@
+import asyncio
+import functools
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking libraries (gspread, sync redis) are called from a bounded thread pool
+# so the aiogram event loop keeps serving other updates while I/O is in flight.
+BLOCKING_POOL_SIZE = int(os.environ.get('BLOCKING_POOL_SIZE', 8))
+# Default timeout in seconds for a single blocking call
+BLOCKING_CALL_TIMEOUT = float(os.environ.get('BLOCKING_CALL_TIMEOUT', 30))
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool for blocking calls.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix='kvira_blocking')
+    return _executor
+
+
+async def run_blocking(func, *args, timeout: float | None = None, **kwargs):
+    """Run a blocking function in the thread pool and await the result.
+    Raises asyncio.TimeoutError if the call takes longer than timeout
+    (BLOCKING_CALL_TIMEOUT by default). The thread itself can not be
+    interrupted, it finishes in the background. With timeout=math.inf
+    the call is awaited until the thread returns.
+    """
+    if timeout is None:
+        timeout = BLOCKING_CALL_TIMEOUT
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+    if timeout == math.inf:
+        return await future
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"Blocking call {func.__name__} timed out after {timeout} seconds")
+        raise
+
+
+def shutdown_executor() -> None:
+    """Wait for the running blocking calls and stop the thread pool.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.redis_tools import get_redis_service_db
+
+# Number of locks in the punch lock table. Two memberships share a lock
+# only if their row ids fall into the same stripe.
+PUNCH_LOCK_STRIPES = int(os.environ.get('PUNCH_LOCK_STRIPES', 64))
+# Seconds a distributed lock is held at most if its worker dies without releasing it
+LOCK_LEASE = float(os.environ.get('LOCK_LEASE', 30))
+# Seconds to wait for a distributed lock before giving up
+LOCK_WAIT_TIMEOUT = float(os.environ.get('LOCK_WAIT_TIMEOUT', 10))
+# Pause between attempts to take a busy distributed lock
+LOCK_RETRY_DELAY = 0.05
+
+LOCK_KEY_PREFIX = 'lock'
+
+# Deletes the lock only if it is still held with our token,
+# so a lock that expired and was taken by another worker is left alone.
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Prolongs the lease only if the lock is still ours
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LockNotAcquired(Exception):
+    pass
+
+
+class StripedLock:
+    """Fixed table of asyncio locks. The same key always maps to the same lock,
+    so work on one key is serialized while different keys mostly run concurrently.
+    """
+
+    def __init__(self, stripes: int = PUNCH_LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+
+    def get(self, key) -> asyncio.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class RedisLock:
+    """Lock shared by all bot workers, stored in Redis with SET NX PX.
+    The lease makes the lock expire if the worker holding it dies.
+    """
+
+    def __init__(self, name: str, lease: float = LOCK_LEASE, wait_timeout: float = LOCK_WAIT_TIMEOUT):
+        self.key = f"{LOCK_KEY_PREFIX}:{name}"
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.token = uuid.uuid4().hex
+
+    async def try_acquire(self) -> bool:
+        """Take the lock if it is free, without waiting."""
+        metrics.count_redis_call('lock_acquire')
+        return bool(await get_redis_service_db().set(self.key, self.token, nx=True, px=int(self.lease * 1000)))
+
+    async def acquire(self) -> None:
+        """Wait for the lock, raises LockNotAcquired after wait_timeout seconds."""
+        deadline = time.monotonic() + self.wait_timeout
+        while not await self.try_acquire():
+            if time.monotonic() >= deadline:
+                raise LockNotAcquired(f"{self.key} is busy for more than {self.wait_timeout} seconds")
+            await asyncio.sleep(LOCK_RETRY_DELAY)
+
+    async def extend(self) -> bool:
+        """Start a new lease, False if the lock was lost meanwhile."""
+        metrics.count_redis_call('lock_extend')
+        return bool(await get_redis_service_db().eval(_EXTEND_SCRIPT, 1, self.key, self.token, int(self.lease * 1000)))
+
+    async def hold(self, awaitable):
+        """Await while renewing the lease, so the lock outlives
+        work that can not be interrupted, like a running Sheets call.
+        """
+        task = asyncio.ensure_future(awaitable)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self.lease / 3)
+            if done:
+                return task.result()
+            if not await self.extend():
+                logging.warning(f"Lock {self.key} was lost while held")
+
+    async def release(self) -> None:
+        metrics.count_redis_call('lock_release')
+        if not await get_redis_service_db().eval(_RELEASE_SCRIPT, 1, self.key, self.token):
+            logging.warning(f"Lock {self.key} expired before it was released")
+
+    async def __aenter__(self) -> 'RedisLock':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.release()
+
+
+# Serializes check-ins of one membership inside this worker, keyed by row_id
+punch_locks = StripedLock()
+
+
+@asynccontextmanager
+async def row_lock(row_id: int):
+    """Serialize punches and activations of the membership in the row
+    across all workers. Taps in this worker queue on the local lock first,
+    so only one of them at a time polls Redis.
+    The time spent waiting is observed in metrics.punch_lock_wait.
+    """
+    start = time.perf_counter()
+    async with punch_locks.get(row_id):
+        lock = RedisLock(f"row:{row_id}")
+        try:
+            await lock.acquire()
+        finally:
+            metrics.punch_lock_wait.observe(time.perf_counter() - start)
+        try:
+            yield lock
+        finally:
+            await lock.release()
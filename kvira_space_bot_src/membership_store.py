@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import date
+
+from kvira_space_bot_src.executor import run_blocking
+from kvira_space_bot_src.locks import RedisLock
+from kvira_space_bot_src.metrics import count_redis_call
+from kvira_space_bot_src.redis_tools import get_redis_service_db
+from kvira_space_bot_src.spreadsheets import api, async_api
+from kvira_space_bot_src.spreadsheets.scheduler import PRIORITY_BACKGROUND
+from kvira_space_bot_src.spreadsheets.data import (
+    DateStorageError,
+    MembershipRow,
+    Punches,
+    UsersSnapshot,
+    WorkingMembership,
+    USERS_COLUMNS,
+)
+from kvira_space_bot_src.spreadsheets.write_queue import (
+    write_queue,
+    SHEETS_FLUSH_INTERVAL,
+    SHEETS_FLUSH_TIMEOUT,
+)
+
+# Working memberships mirrored from the Memberships-bot sheet into Redis.
+# Every nickname of the sheet has a hash MEMBERSHIP_KEY:<nickname> with the
+# row of its working membership (row_id is empty if there is none).
+# One worker pulls the sheet every MEMBERSHIP_SYNC_INTERVAL seconds,
+# handlers read the hashes and fall back to the sheet when the last sync
+# is older than MEMBERSHIP_STALE_AFTER seconds.
+# Syncs are incremental: rows are compared by digest with the previous sync
+# of this worker and only the nicknames of changed rows are written.
+
+MEMBERSHIP_KEY = 'membership'
+# Nicknames present in the store, to delete the ones gone from the sheet
+MEMBERSHIP_NICKNAMES_KEY = 'membership_nicknames'
+# Unix time of the last finished sync
+MEMBERSHIP_SYNCED_AT_KEY = 'membership_synced_at'
+# Id of the store contents, changes if Redis loses them
+MEMBERSHIP_EPOCH_KEY = 'membership_epoch'
+
+MEMBERSHIP_SYNC_INTERVAL = float(os.environ.get('MEMBERSHIP_SYNC_INTERVAL', 10))
+MEMBERSHIP_STALE_AFTER = float(os.environ.get('MEMBERSHIP_STALE_AFTER', 300))
+# A hash changed by a check-in is not overwritten from a sheet read started
+# this soon after the change, the write may still be in a worker's queue.
+WRITE_THROUGH_GRACE = SHEETS_FLUSH_INTERVAL + SHEETS_FLUSH_TIMEOUT
+# Hashes written per pipeline during a sync
+SYNC_PIPELINE_SIZE = 500
+
+MEMBERSHIP_COLUMNS = USERS_COLUMNS
+
+# State of the previous sync done by this worker: row_id -> (digest, nickname),
+# the day it was done (memberships expire with the date) and the nicknames
+# left out because of a recent check-in.
+_row_digests: dict[int, tuple[str, str]] | None = None
+_store_epoch: str | None = None
+_synced_day: date | None = None
+_deferred_nicknames: set[str] = set()
+
+
+def _membership_key(nickname: str) -> str:
+    return f"{MEMBERSHIP_KEY}:{nickname}"
+
+
+def membership_to_hash(membership: WorkingMembership) -> dict[str, str]:
+    """Flatten the membership into the fields of its Redis hash."""
+    fields = {
+        'row_id': '' if membership.row_id is None else str(membership.row_id),
+        'activated': '1' if membership.activated else '0',
+        'errors': json.dumps(
+            [{'error_message': error.error_message, 'row_data': error.row_data} for error in membership.errors],
+            default=str,
+        ),
+        'changed_at': '0',
+    }
+    for column in MEMBERSHIP_COLUMNS:
+        fields[column] = '' if membership.membership_data is None else str(membership.membership_data.get(column, ''))
+    return fields
+
+
+def membership_from_hash(fields: dict[bytes, bytes]) -> WorkingMembership:
+    """Inverse of membership_to_hash."""
+    fields = {key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()}
+    errors = [DateStorageError(**error) for error in json.loads(fields.get('errors') or '[]')]
+    if fields.get('row_id', '') == '':
+        return WorkingMembership(row_id=None, activated=None, errors=errors, membership_data=None)
+    row = MembershipRow(int(fields['row_id']), *(fields.get(column, '') for column in MEMBERSHIP_COLUMNS))
+    return WorkingMembership(
+        row_id=row.row_id,
+        activated=fields['activated'] == '1',
+        membership_data=row,
+        errors=errors,
+        punches=row.punches,
+    )
+
+
+def row_digests(snapshot: UsersSnapshot) -> dict[int, tuple[str, str]]:
+    """Digest and nickname of every row of the users sheet, by row_id."""
+    digests = dict()
+    for row in snapshot.rows:
+        cells = '\x1f'.join(str(row[column]) for column in MEMBERSHIP_COLUMNS)
+        digests[row.row_id] = (hashlib.blake2b(cells.encode('utf-8'), digest_size=8).hexdigest(), row.tg_nickname)
+    return digests
+
+
+def changed_nicknames(previous: dict[int, tuple[str, str]], current: dict[int, tuple[str, str]]) -> set[str]:
+    """Nicknames of the rows inserted, edited or deleted between two syncs.
+    A row that changed its nickname counts for both nicknames.
+    """
+    nicknames = set()
+    for row_id in previous.keys() | current.keys():
+        before = previous.get(row_id)
+        after = current.get(row_id)
+        if before == after:
+            continue
+        if before is not None:
+            nicknames.add(before[1])
+        if after is not None:
+            nicknames.add(after[1])
+    nicknames.discard('')
+    return nicknames
+
+
+def working_memberships(snapshot: UsersSnapshot, nicknames: set[str] | None = None) -> dict[str, WorkingMembership]:
+    """Working membership of every nickname in the users sheet,
+    or only of the given ones which are still in it.
+    """
+    if nicknames is None:
+        # Full sync, one pass over the rows
+        memberships = api.find_working_memberships_bulk(snapshot.rows)
+        memberships.pop('', None)
+        return memberships
+    return {
+        nickname: api.find_working_membership(nickname, snapshot.rows, index=snapshot.index)
+        for nickname in nicknames
+        if nickname != '' and nickname in snapshot.index.positions
+    }
+
+
+async def get_membership(username: str) -> WorkingMembership | None:
+    """Working membership of the user from Redis, in one round trip.
+    None if the store is stale, then the caller reads the sheet.
+    """
+    redis = get_redis_service_db()
+    count_redis_call('get_membership')
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(MEMBERSHIP_SYNCED_AT_KEY)
+        pipe.hgetall(_membership_key(username))
+        synced_at, fields = await pipe.execute()
+    if synced_at is None or time.time() - float(synced_at) > MEMBERSHIP_STALE_AFTER:
+        return None
+    if not fields:
+        return WorkingMembership(row_id=None, activated=None, membership_data=None)
+    if b'row_id' not in fields:
+        # Only a write-through reached Redis, the sync has not seen this nickname yet
+        return None
+    return membership_from_hash(fields)
+
+
+async def record_activation(username: str, current_date: str) -> None:
+    """Write-through of an activation queued for the sheet."""
+    count_redis_call('record_activation')
+    await get_redis_service_db().hset(_membership_key(username), mapping={
+        'activated': '1',
+        'date_activated': current_date,
+        'changed_at': str(time.time()),
+    })
+
+
+async def record_punch(username: str, punches: Punches) -> None:
+    """Write-through of a punch queued for the sheet, punches includes the new day."""
+    count_redis_call('record_punch')
+    await get_redis_service_db().hset(_membership_key(username), mapping={
+        'punches': punches.to_string(),
+        'changed_at': str(time.time()),
+    })
+
+
+async def save_memberships(
+    memberships: dict[str, WorkingMembership],
+    read_started_at: float,
+    removed: set[str] | None = None,
+) -> set[str]:
+    """Write the memberships read from the sheet and delete the removed nicknames.
+    With removed=None the stored memberships are replaced as a whole.
+    Hashes changed by check-ins shortly before the read are kept,
+    their nicknames are returned.
+    """
+    redis = get_redis_service_db()
+    if removed is None:
+        count_redis_call('membership_nicknames')
+        stored = {nickname.decode('utf-8') for nickname in await redis.smembers(MEMBERSHIP_NICKNAMES_KEY)}
+        removed = stored - set(memberships)
+    nicknames = list(memberships)
+    deferred = set()
+    for start in range(0, len(nicknames), SYNC_PIPELINE_SIZE):
+        chunk = nicknames[start:start + SYNC_PIPELINE_SIZE]
+        count_redis_call('membership_changed_at')
+        async with redis.pipeline(transaction=False) as pipe:
+            for nickname in chunk:
+                pipe.hget(_membership_key(nickname), 'changed_at')
+            changed_at = await pipe.execute()
+        count_redis_call('save_memberships')
+        async with redis.pipeline(transaction=False) as pipe:
+            for nickname, changed in zip(chunk, changed_at):
+                if changed is not None and float(changed) > read_started_at - WRITE_THROUGH_GRACE:
+                    deferred.add(nickname)
+                    continue
+                key = _membership_key(nickname)
+                pipe.delete(key)
+                pipe.hset(key, mapping=membership_to_hash(memberships[nickname]))
+            pipe.sadd(MEMBERSHIP_NICKNAMES_KEY, *chunk)
+            await pipe.execute()
+    count_redis_call('save_memberships')
+    async with redis.pipeline(transaction=True) as pipe:
+        if removed:
+            pipe.delete(*(_membership_key(nickname) for nickname in removed))
+            pipe.srem(MEMBERSHIP_NICKNAMES_KEY, *removed)
+        pipe.set(MEMBERSHIP_SYNCED_AT_KEY, time.time())
+        await pipe.execute()
+    return deferred
+
+
+async def sync_memberships(full: bool = False) -> bool:
+    """Pull the users sheet and mirror the working memberships into Redis.
+    Only the nicknames of rows changed since the previous sync of this worker
+    are written, unless full is set, this worker did not sync yet or the day changed.
+    Only one worker syncs at a time, returns False if another one is at it.
+    """
+    global _row_digests, _synced_day, _deferred_nicknames, _store_epoch
+    lock = RedisLock('membership_sync', lease=MEMBERSHIP_SYNC_INTERVAL + SHEETS_FLUSH_TIMEOUT)
+    if not await lock.try_acquire():
+        return False
+    try:
+        sync_started_at = time.time()
+        # Local writes which are not in the sheet yet must not be dropped
+        snapshot = await async_api.get_users_snapshot(
+            force_refresh=not write_queue.has_pending(),
+            priority=PRIORITY_BACKGROUND,
+        )
+        # A cached copy is older than this sync, check-ins are compared with its own read
+        read_started_at = snapshot.downloaded_at
+        digests = await run_blocking(row_digests, snapshot)
+        today = date.today()
+        count_redis_call('membership_epoch')
+        epoch = await get_redis_service_db().get(MEMBERSHIP_EPOCH_KEY)
+        epoch = epoch.decode('utf-8') if epoch is not None else None
+        if full or _row_digests is None or _synced_day != today or epoch is None or epoch != _store_epoch:
+            nicknames = None
+            removed = None
+        else:
+            nicknames = changed_nicknames(_row_digests, digests) | _deferred_nicknames
+            removed = {nickname for nickname in nicknames if nickname not in snapshot.index.positions}
+        memberships = await run_blocking(working_memberships, snapshot, nicknames)
+        deferred = await save_memberships(memberships, read_started_at, removed)
+        if epoch is None:
+            epoch = uuid.uuid4().hex
+            count_redis_call('membership_epoch')
+            await get_redis_service_db().set(MEMBERSHIP_EPOCH_KEY, epoch)
+        _row_digests, _synced_day, _deferred_nicknames, _store_epoch = digests, today, deferred, epoch
+    finally:
+        await lock.release()
+    mode = 'full' if nicknames is None else 'incremental'
+    logging.info(
+        f"Memberships synced ({mode}): {len(memberships) - len(deferred)} written, {len(removed or ())} removed, "
+        f"{len(deferred)} deferred in {time.time() - sync_started_at:.2f}s"
+    )
+    return True
+
+
+async def membership_sync_loop() -> None:
+    """Sync the memberships every MEMBERSHIP_SYNC_INTERVAL seconds."""
+    while True:
+        try:
+            await sync_memberships()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Membership sync failed: {e}")
+        await asyncio.sleep(MEMBERSHIP_SYNC_INTERVAL)
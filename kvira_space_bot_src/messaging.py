@@ -2,21 +2,51 @@
 from aiogram import exceptions
 import logging
 import asyncio
+import time
 from aiogram import Bot
+import os
+from kvira_space_bot_src.rate_limit import telegram_limiter
+from kvira_space_bot_src import metrics
 from kvira_space_bot_src.redis_tools import (
     read_chats_from_redis_list,
+    add_chat_to_redis_list,
     ADMIN_CHATS_KEY,
-    read_json_from_redis,
-    TEXT_SAVED_KEY,
     TelegramUser,
+    CACHE_UPDATES_CHANNEL,
+    CACHE_TEXTS,
+    CACHE_ADMIN_CHATS,
+    CACHE_MEMBERSHIPS,
+    CACHE_USERS,
+    user_cache,
+    get_redis_service_db,
+    parse_cache_update,
+    publish_cache_update,
+    read_text_catalog_from_redis,
+    save_text_catalog_to_redis,
 )
 from kvira_space_bot_src.spreadsheets.api import (
     Lang,
+    expire_users_snapshot,
     WorkingMembership,
     get_days_left_from_membership,
 )
 from datetime import datetime, timedelta
 
+# Seconds between text catalog version and admin chats checks, in case a pub/sub notification is missed
+TEXT_VERSION_CHECK_INTERVAL = float(os.environ.get('TEXT_VERSION_CHECK_INTERVAL', 60))
+
+# In-process copy of the text catalog (Prompts-bot sheet) and its version in Redis
+_text_catalog: dict = dict()
+_text_catalog_version: int | None = None
+
+# How many times a message is resent after Telegram flood control
+TELEGRAM_SEND_RETRIES = int(os.environ.get('TELEGRAM_SEND_RETRIES', 3))
+
+# Admin chat ids cached from Redis, None means not loaded
+_admin_chats: list[int] | None = None
+# References to the running background notifications
+_admin_notifications: set[asyncio.Task] = set()
+
 
 def join_messages(messages: list[str]) -> str:
     """Join the messages in the list into one string.
@@ -51,40 +81,176 @@ def check_membership(user: TelegramUser, membership: WorkingMembership) -> list[
     return messages
 
 async def send_message_to_user(user_id: int, text: str, bot: Bot, disable_notification: bool = False) -> bool:
-    try:
-        await bot.send_message(user_id, text, disable_notification=disable_notification)
-    except exceptions.BotBlocked:
-        logging.error(f"Target [ID:{user_id}]: blocked by user")
-    except exceptions.ChatNotFound:
-        logging.error(f"Target [ID:{user_id}]: invalid user ID")
-    except exceptions.RetryAfter as e:
-        logging.error(f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.timeout} seconds.")
-        await asyncio.sleep(e.timeout)
-        return await send_message_to_user(user_id, text)  # Recursive call
-    except exceptions.UserDeactivated:
-        logging.error(f"Target [ID:{user_id}]: user is deactivated")
-    except exceptions.TelegramAPIError:
-        logging.exception(f"Target [ID:{user_id}]: failed")
-    else:
-        logging.info(f"Target [ID:{user_id}]: success")
-        return True
+    """Send a message within the Telegram rate limits.
+    On flood control the message is retried after the requested delay,
+    at most TELEGRAM_SEND_RETRIES times.
+    """
+    for attempt in range(TELEGRAM_SEND_RETRIES + 1):
+        await telegram_limiter.acquire(user_id)
+        try:
+            await bot.send_message(user_id, text, disable_notification=disable_notification)
+        except exceptions.TelegramRetryAfter as e:
+            metrics.telegram_retry_after.inc()
+            if attempt == TELEGRAM_SEND_RETRIES:
+                break
+            logging.error(f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds.")
+            metrics.telegram_retry_after_seconds.inc(e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except exceptions.TelegramForbiddenError:
+            logging.error(f"Target [ID:{user_id}]: blocked by user or user is deactivated")
+            metrics.telegram_send_failures.inc(reason='forbidden')
+        except exceptions.TelegramBadRequest:
+            logging.error(f"Target [ID:{user_id}]: invalid user ID")
+            metrics.telegram_send_failures.inc(reason='bad_request')
+        except exceptions.TelegramAPIError:
+            logging.exception(f"Target [ID:{user_id}]: failed")
+            metrics.telegram_send_failures.inc(reason='api_error')
+        else:
+            logging.info(f"Target [ID:{user_id}]: success")
+            return True
+        return False
+    logging.error(f"Target [ID:{user_id}]: gave up after {TELEGRAM_SEND_RETRIES} retries")
+    metrics.telegram_send_failures.inc(reason='retry_after')
     return False
 
     # Admin handler zone
     # Admin chats are defined in the .env file and messages are sent to them when
 
-async def send_message_to_admins(text: str, bot: Bot):
-    for admin_chat_id in read_chats_from_redis_list(ADMIN_CHATS_KEY): 
-        await send_message_to_user(int(admin_chat_id), text, bot)
+async def get_admin_chats() -> list[int]:
+    """Get the admin chats, cached in memory until a worker adds a chat.
+    """
+    global _admin_chats
+    if _admin_chats is None:
+        _admin_chats = [int(chat_id) for chat_id in await read_chats_from_redis_list(ADMIN_CHATS_KEY)]
+    return _admin_chats
+
+def invalidate_admin_chats() -> None:
+    """Make the next get_admin_chats call read Redis again.
+    """
+    global _admin_chats
+    _admin_chats = None
+
+async def add_admin_chat(chat_id: int) -> None:
+    """Register the chat as an admin chat.
+    """
+    await add_chat_to_redis_list(chat_id, ADMIN_CHATS_KEY)
+    invalidate_admin_chats()
+    await publish_cache_update(CACHE_ADMIN_CHATS)
+
+async def send_message_to_admins(text: str, bot: Bot) -> None:
+    """Send the message to all admin chats concurrently.
+    """
+    admin_chats = await get_admin_chats()
+    await asyncio.gather(*(send_message_to_user(admin_chat_id, text, bot) for admin_chat_id in admin_chats))
+
+def notify_admins(text: str, bot: Bot) -> None:
+    """Send the message to the admins in the background,
+    so the user does not wait for it.
+    """
+    task = asyncio.create_task(send_message_to_admins(text, bot))
+    _admin_notifications.add(task)
+    task.add_done_callback(_admin_notifications.discard)
+
+async def wait_admin_notifications() -> None:
+    """Wait until the background admin notifications are sent, used on shutdown.
+    """
+    if _admin_notifications:
+        await asyncio.gather(*_admin_notifications, return_exceptions=True)
 
         
 def get_message_for_user(str_id: str, lang: Lang) -> str:
-    """This is used to get cached messages from the Redis database.
+    """Get a message from the in-process text catalog.
+    The catalog is loaded by load_text_catalog and kept up to date by cache_updates_listener.
     """
-    text_dict = read_json_from_redis(TEXT_SAVED_KEY)
     try:
-        text = text_dict[str_id][lang.value]
+        text = _text_catalog[str_id][lang.value]
     except KeyError:
-        logging.error(f"Message with id {str_id} not found in the Redis database.")
+        logging.error(f"Message with id {str_id} not found in the text catalog.")
         return "Message not found. Please contact the administrator with a bugreport."
-    return text
\ No newline at end of file
+    return text
+
+
+def get_text_catalog() -> dict:
+    """The in-process text catalog, empty until it is loaded.
+    """
+    return _text_catalog
+
+
+def set_text_catalog(texts: dict, version: int | None = None) -> None:
+    """Replace the in-process text catalog.
+    """
+    global _text_catalog, _text_catalog_version
+    _text_catalog = texts
+    _text_catalog_version = version
+
+
+async def load_text_catalog() -> bool:
+    """Load the text catalog from Redis if its version changed.
+    Costs one GET when the catalog is up to date. Returns True if reloaded.
+    """
+    version, texts = await read_text_catalog_from_redis(known_version=_text_catalog_version)
+    if texts is None:
+        return False
+    set_text_catalog(texts, version)
+    logging.info(f"Text catalog version {version} loaded, {len(texts)} messages")
+    return True
+
+
+async def publish_text_catalog(texts: dict) -> int:
+    """Store a new text catalog in Redis and notify all workers.
+    Returns the new version.
+    """
+    version = await save_text_catalog_to_redis(texts)
+    set_text_catalog(texts, version)
+    logging.info(f"Text catalog version {version} published")
+    return version
+
+
+def apply_cache_update(cache: str) -> bool:
+    """Drop the in-process copy of the cache another worker changed.
+    Returns True if the text catalog has to be reloaded.
+    """
+    if cache == CACHE_ADMIN_CHATS:
+        invalidate_admin_chats()
+    elif cache == CACHE_MEMBERSHIPS:
+        expire_users_snapshot()
+    elif cache.startswith(f"{CACHE_USERS}/"):
+        user_cache.forget(cache.partition('/')[2])
+    return cache == CACHE_TEXTS
+
+
+async def cache_updates_listener() -> None:
+    """Follow the changes other workers announce on CACHE_UPDATES_CHANNEL:
+    reload the text catalog, drop the admin chats and user profiles,
+    expire the users sheet copy.
+    Texts and admin chats are also checked every TEXT_VERSION_CHECK_INTERVAL seconds.
+    Cached user profiles are dropped whenever the subscription is lost.
+    """
+    last_check = time.monotonic()
+    while True:
+        pubsub = get_redis_service_db().pubsub()
+        try:
+            await pubsub.subscribe(CACHE_UPDATES_CHANNEL)
+            while True:
+                # A steady stream of announcements must not postpone the check
+                next_check = max(last_check + TEXT_VERSION_CHECK_INTERVAL - time.monotonic(), 0)
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=next_check)
+                if time.monotonic() - last_check >= TEXT_VERSION_CHECK_INTERVAL:
+                    last_check = time.monotonic()
+                    invalidate_admin_chats()
+                    await load_text_catalog()
+                if message is None:
+                    continue
+                cache = parse_cache_update(message['data'])
+                if cache is not None and apply_cache_update(cache):
+                    await load_text_catalog()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Cache updates listener failed: {e}")
+            # Profile changes announced meanwhile would be missed
+            user_cache.clear()
+            await asyncio.sleep(TEXT_VERSION_CHECK_INTERVAL)
+        finally:
+            await pubsub.aclose()
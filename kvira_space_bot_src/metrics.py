@@ -0,0 +1,254 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# In-process metrics in the Prometheus text format.
+# Served on http://<host>:METRICS_PORT/metrics and summarized by the /metrics admin command.
+
+# Port of the metrics endpoint, 0 disables it
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9100))
+
+# Latency buckets in seconds, from a Redis call to a slow Google Sheets read
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21)
+
+_registry: list = list()
+# Sheets calls are measured in the worker threads of the blocking pool
+_lock = threading.Lock()
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, one value per label set."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[tuple, float] = dict()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def snapshot(self) -> list[tuple[tuple, float]]:
+        with _lock:
+            return sorted(self.values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self.snapshot():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, one value per label set."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[tuple, float] = dict()
+        _registry.append(self)
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def snapshot(self) -> list[tuple[tuple, float]]:
+        with _lock:
+            return sorted(self.values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.snapshot():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, one series per label set."""
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # label set -> [bucket counts..., +Inf count], sum
+        self.series: dict[tuple, tuple[list[int], list[float]]] = dict()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            if key not in self.series:
+                self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self.series[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the with block, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self.series.get(tuple(sorted(labels.items())))
+        return sum(series[0]) if series else 0
+
+    def snapshot(self) -> list[tuple[tuple, list[int], float]]:
+        with _lock:
+            return sorted((key, list(counts), total[0]) for key, (counts, total) in self.series.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, counts, total in self.snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = key + (('le', _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+handler_latency = Histogram('kvira_handler_latency_seconds', "Time spent in an aiogram handler.")
+handler_errors = Counter('kvira_handler_errors_total', "Handlers that raised an exception.")
+sheets_call_latency = Histogram('kvira_sheets_call_latency_seconds', "Duration of Google Sheets calls.")
+sheets_call_errors = Counter('kvira_sheets_call_errors_total', "Google Sheets calls that raised an exception.")
+sheets_queue_depth = Gauge('kvira_sheets_queue_depth', "Google Sheets calls waiting for quota.")
+sheets_queue_wait = Histogram('kvira_sheets_queue_wait_seconds', "Time a Google Sheets call waited for quota.")
+sheets_throttled = Counter('kvira_sheets_throttled_total', "Google Sheets calls that had to wait for quota.")
+sheets_retries = Counter('kvira_sheets_retries_total', "Google Sheets calls retried after a quota or server error.")
+single_flight_joined = Counter('kvira_single_flight_joined_total', "Calls served by a load already in flight.")
+redis_calls = Counter('kvira_redis_calls_total', "Round trips to Redis.")
+redis_calls_per_update = Histogram(
+    'kvira_redis_calls_per_update', "Redis round trips made while handling one update.", buckets=ROUND_TRIP_BUCKETS,
+)
+telegram_send_failures = Counter('kvira_telegram_send_failures_total', "Messages that could not be delivered.")
+telegram_retry_after = Counter('kvira_telegram_retry_after_total', "Flood control (RetryAfter) answers from Telegram.")
+telegram_retry_after_seconds = Counter(
+    'kvira_telegram_retry_after_seconds_total', "Seconds slept because of Telegram flood control.",
+)
+startup_phase_seconds = Gauge('kvira_startup_phase_seconds', "Duration of the startup phases of this worker.")
+punch_lock_wait = Histogram('kvira_punch_lock_wait_seconds', "Time a check-in waited for the punch lock.")
+
+# Redis round trips of the update being handled, None outside of an update
+_update_redis_calls: contextvars.ContextVar[list[int] | None] = contextvars.ContextVar(
+    'update_redis_calls', default=None,
+)
+
+
+def count_redis_call(operation: str) -> None:
+    """Record one round trip to Redis, also for the update being handled."""
+    redis_calls.inc(operation=operation)
+    calls = _update_redis_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+
+@contextmanager
+def track_update_redis_calls():
+    """Count the Redis round trips made inside the with block
+    and observe them in redis_calls_per_update.
+    """
+    calls = [0]
+    token = _update_redis_calls.set(calls)
+    try:
+        yield
+    finally:
+        _update_redis_calls.reset(token)
+        redis_calls_per_update.observe(calls[0])
+
+
+def sheets_call(func):
+    """Decorator for functions of spreadsheets.api that go to Google Sheets."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            with sheets_call_latency.time(call=func.__name__):
+                return func(*args, **kwargs)
+        except Exception:
+            sheets_call_errors.inc(call=func.__name__)
+            raise
+    return wrapper
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = list()
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def summary() -> str:
+    """Short human readable digest for the /metrics admin command."""
+    lines = list()
+    for metric in _registry:
+        if isinstance(metric, Histogram):
+            for key, counts, total in metric.snapshot():
+                count = sum(counts)
+                labels = ','.join(label for _, label in key)
+                name = f"{metric.name}[{labels}]" if labels else metric.name
+                lines.append(f"{name}: n={count} avg={total / count:.3f}")
+        else:
+            for key, value in metric.snapshot():
+                labels = ','.join(label for _, label in key)
+                name = f"{metric.name}[{labels}]" if labels else metric.name
+                lines.append(f"{name}: {_format_value(value)}")
+    return '\n'.join(lines) or "No metrics yet."
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+def add_metrics_route(app: web.Application) -> None:
+    app.router.add_get('/metrics', _metrics_view)
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Serve /metrics on the port, returns the runner to clean up on shutdown."""
+    if not port:
+        return None
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    logging.info(f"Metrics are served on port {port}")
+    return runner
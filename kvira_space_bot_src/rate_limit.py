@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+# Telegram allows about 30 messages per second in total
+# and about one message per second to the same chat.
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 25))
+TELEGRAM_PER_CHAT_RATE = float(os.environ.get('TELEGRAM_PER_CHAT_RATE', 1))
+# Number of per-chat buckets kept in memory
+TELEGRAM_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Async token bucket. Tokens are refilled with `rate` per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Wait until `tokens` are available and take them.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        # The lock keeps the waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                delay = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self._tokens -= tokens
+        return waited
+
+
+class TelegramRateLimiter:
+    """Global bucket plus one bucket per chat.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, per_chat_rate: float = TELEGRAM_PER_CHAT_RATE):
+        self.per_chat_rate = per_chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > TELEGRAM_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int) -> float:
+        """Wait for a free slot to send one message to the chat.
+        Returns the number of seconds spent waiting.
+        """
+        waited = await self._chat_bucket(chat_id).acquire()
+        waited += await self.global_bucket.acquire()
+        return waited
+
+
+telegram_limiter = TelegramRateLimiter()
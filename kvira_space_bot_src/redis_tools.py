@@ -1,23 +1,52 @@
 import asyncio
 import os
+import time
+import uuid
+from collections import OrderedDict
 
 import logging
 import json
 from kvira_space_bot_src.spreadsheets.data import Lang
-from redis import Redis
+from kvira_space_bot_src.metrics import count_redis_call
+from redis.asyncio import Redis, ConnectionPool
 from pydantic import BaseModel
-from asyncio import Lock
 from pydantic import ValidationError
 
 ALL_USERS_KEY_LIST = 'all_users_redis_key_list'
 ADMIN_CHATS_KEY = 'admin_chats_redis_key'
 TEXT_SAVED_KEY = 'text_saved_redis_key'
+TEXT_VERSION_KEY = 'text_version_redis_key'
+BROADCAST_KEY = 'broadcast_redis_key'
+# Pub/sub channel where workers announce changes of the shared data,
+# messages are '<cache name>:<worker id>', a changed user profile is
+# announced as '<CACHE_USERS>/<user id>:<worker id>'
+CACHE_UPDATES_CHANNEL = 'cache_updates_channel'
+CACHE_TEXTS = 'texts'
+CACHE_ADMIN_CHATS = 'admin_chats'
+CACHE_MEMBERSHIPS = 'memberships'
+CACHE_USERS = 'users'
+# Tells the own announcements apart from the ones of the other workers
+WORKER_ID = uuid.uuid4().hex[:8]
 
-redis_user_db_lock = Lock()
+# User profiles are hashes USER_KEY:<user_id> with the fields of TelegramUser.
+# Older profiles are JSON strings stored under the bare user id, they are
+# still read and moved to a hash the first time they are used.
+USER_KEY = 'user'
+# Profiles kept in process: how many, and for how many seconds after the last use
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 3600))
+
+# Check-ins made by any worker, kept until the sheet surely has them
+CHECK_IN_MARK_KEY = 'check_in_mark'
+CHECK_IN_MARK_TTL = 2 * 24 * 3600
 
 # if REDIS_HOST is not set, use the default value
 redis_host = os.environ.get('REDIS_HOST', 'kvira_redis')
 redis_port = os.environ.get('REDIS_PORT', 6379)
+# Connections are checked if they were idle for this many seconds,
+# instead of pinging Redis on every request.
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 32))
 
 print(f"REDIS_HOST: {redis_host}")
 
@@ -25,9 +54,19 @@ print(f"REDIS_HOST: {redis_host}")
 USER_DATA_DB = 0
 SERVICE_DATA_DB = 1
 
-os.environ.get('AWS_MAX_POOL_CONNECTIONS', 1)
-redis_user_db = Redis(host=redis_host, port=redis_port, db=USER_DATA_DB)
-redis_service_db = Redis(host=redis_host, port=redis_port, db=SERVICE_DATA_DB)
+
+def _connection_pool(db: int) -> ConnectionPool:
+    return ConnectionPool(
+        host=redis_host,
+        port=redis_port,
+        db=db,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+# One shared pool per database
+redis_user_db = Redis(connection_pool=_connection_pool(USER_DATA_DB))
+redis_service_db = Redis(connection_pool=_connection_pool(SERVICE_DATA_DB))
 
 class UserPass(BaseModel):
     pass
@@ -46,87 +85,303 @@ def get_redis_service_db() -> Redis:
     """For using in notebooks and tests."""
     return redis_service_db
 
-def init_redis() -> None:
-    """this function checks if global variables are redis objects is working properly
-    if not, it will try to reconnect to the redis server
+async def close_redis() -> None:
+    """Close the connection pools on shutdown.
     """
-    global redis_user_db
-    global redis_service_db
-    try:
-        redis_user_db.ping()
-        redis_service_db.ping()
-    except:
-        redis_user_db = Redis(host=redis_host, port=redis_port, db=USER_DATA_DB)
-        redis_service_db = Redis(host=redis_host, port=redis_port, db=SERVICE_DATA_DB)
-        redis_user_db.ping()
-        redis_service_db.ping()
-
-def add_chat_to_redis_list(chat_id: str, key: str) -> None:
+    await redis_user_db.aclose()
+    await redis_service_db.aclose()
+
+async def add_chat_to_redis_list(chat_id: str, key: str) -> None:
     """Adds this chat_id to the Redis database list of admin chats.
     """
     redis = redis_service_db
-    redis.sadd(key, chat_id)
+    count_redis_call('add_chat')
+    await redis.sadd(key, chat_id)
     
-def read_chats_from_redis_list(key: str) -> list[str]:
+async def read_chats_from_redis_list(key: str) -> list[str]:
     """Reads the list of admin chats from the Redis database.
     Decode each chat_id from bytes to string.
     """
     redis = redis_service_db
-    return [chat_id.decode('utf-8') for chat_id in redis.smembers(key)]
+    count_redis_call('read_chats')
+    return [chat_id.decode('utf-8') for chat_id in await redis.smembers(key)]
+
+def _user_key(user_id: str) -> str:
+    return f"{USER_KEY}:{user_id}"
+
+
+def user_to_hash(user: TelegramUser) -> dict[str, str]:
+    return {'user_id': user.user_id, 'username': user.username, 'lang': user.lang.value}
+
+
+class UserCache:
+    """Bounded LRU of the user profiles used in the last USER_CACHE_TTL seconds.
+    Entries are replaced on every write of the profile by this worker and
+    dropped when another worker announces a change.
+    """
+
+    def __init__(self, size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        # user_id -> (user, last use as time.monotonic())
+        self._users: OrderedDict[str, tuple[TelegramUser, float]] = OrderedDict()
+
+    def get(self, user_id: str) -> TelegramUser | None:
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry[1] > self.ttl:
+            del self._users[user_id]
+            return None
+        self._users[user_id] = (entry[0], now)
+        self._users.move_to_end(user_id)
+        return entry[0]
+
+    def put(self, user: TelegramUser) -> None:
+        if self.size <= 0:
+            return
+        self._users[user.user_id] = (user, time.monotonic())
+        self._users.move_to_end(user.user_id)
+        while len(self._users) > self.size:
+            self._users.popitem(last=False)
+
+    def forget(self, user_id: str) -> None:
+        self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._users.clear()
 
-def add_user_to_redis(user: TelegramUser) -> None:
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+user_cache = UserCache()
+
+
+async def add_user_to_redis(user: TelegramUser) -> None:
     """Add a user to the Redis database.
+    Both commands are sent in one round trip.
     """
     redis = redis_user_db
-    redis.set(user.user_id, user.json())
-    redis.sadd(ALL_USERS_KEY_LIST, user.user_id)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(_user_key(user.user_id), mapping=user_to_hash(user))
+        pipe.sadd(ALL_USERS_KEY_LIST, user.user_id)
+        count_redis_call('add_user')
+        await pipe.execute()
+    user_cache.put(user)
 
 
-def get_user_from_redis(userid: str) -> TelegramUser:
-    """Get a user from the Redis database.
+def parse_user(userid: str, fields: dict[bytes, bytes] | None, legacy: bytes | None = None) -> TelegramUser | None:
+    """Parse a user stored in the Redis database, None if it is missing or broken.
+    fields is the profile hash, legacy the JSON string of an old profile.
     """
-    redis = redis_user_db
-    # Check if the user exists in the database
-    if not redis.exists(userid):
-        return None
-    user = redis.get(userid)
     try:
-        user = TelegramUser.parse_raw(user)
+        if fields:
+            return TelegramUser(**{key.decode('utf-8'): value.decode('utf-8') for key, value in fields.items()})
+        if legacy is not None:
+            return TelegramUser.model_validate_json(legacy)
     except ValidationError:
         logging.error(f"User with id {userid} is not in the correct format.")
+    return None
+
+
+async def get_user_from_redis(userid: str) -> TelegramUser:
+    """Get a user from the in-process cache or the Redis database.
+    A cache miss costs one round trip, an old JSON profile is moved to a hash.
+    """
+    userid = str(userid)
+    user = user_cache.get(userid)
+    if user is not None:
+        return user
+    redis = redis_user_db
+    count_redis_call('get_user')
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hgetall(_user_key(userid))
+        pipe.get(userid)
+        fields, legacy = await pipe.execute()
+    user = parse_user(userid, fields, legacy)
+    if user is None:
         return None
+    if not fields:
+        count_redis_call('migrate_user')
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(_user_key(userid), mapping=user_to_hash(user))
+            pipe.delete(userid)
+            await pipe.execute()
+    user_cache.put(user)
     return user
 
 
-def update_user_lang_in_redis(userid: str, lang: Lang) -> None:
-    """Update the user's language in the Redis database.
+# Sets only the lang of an existing profile. A profile whose hash is gone
+# (Redis flushed, legacy key) is written whole, a lang-only hash can not be parsed.
+# KEYS: profile hash, ALL_USERS_KEY_LIST. ARGV: lang, user_id, username.
+_SET_USER_LANG_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('hset', KEYS[1], 'lang', ARGV[1])
+    return 0
+end
+redis.call('hset', KEYS[1], 'user_id', ARGV[2], 'username', ARGV[3], 'lang', ARGV[1])
+redis.call('sadd', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+async def update_user_lang_in_redis(userid: str, lang: Lang) -> TelegramUser | None:
+    """Update the user's language in the Redis database, the other workers drop their copy.
+    Only the lang field is written, unless the hash is missing.
+    Returns the updated user, None if there is no such user.
+    """
+    user = await get_user_from_redis(userid)
+    if user is None:
+        return None
+    user = user.model_copy(update={'lang': lang})
+    profile = user_to_hash(user)
+    async with redis_user_db.pipeline(transaction=False) as pipe:
+        pipe.eval(
+            _SET_USER_LANG_SCRIPT, 2, _user_key(user.user_id), ALL_USERS_KEY_LIST,
+            profile['lang'], profile['user_id'], profile['username'],
+        )
+        # Pub/sub channels do not depend on the database
+        pipe.publish(CACHE_UPDATES_CHANNEL, _cache_update_message(f"{CACHE_USERS}/{user.user_id}"))
+        count_redis_call('update_user_lang')
+        await pipe.execute()
+    user_cache.put(user)
+    return user
+
+
+async def scan_users(batch_size: int = 500):
+    """Iterate over all users in batches.
+    Ids are streamed from the ALL_USERS_KEY_LIST set with SSCAN,
+    every batch of profiles is fetched in one pipeline.
     """
     redis = redis_user_db
-    user = get_user_from_redis(userid)
-    user.lang = lang
-    add_user_to_redis(redis, user)
+    cursor = 0
+    while True:
+        count_redis_call('scan_users')
+        cursor, user_ids = await redis.sscan(ALL_USERS_KEY_LIST, cursor=cursor, count=batch_size)
+        if user_ids:
+            user_ids = [user_id.decode('utf-8') for user_id in user_ids]
+            count_redis_call('get_users')
+            async with redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.hgetall(_user_key(user_id))
+                    pipe.get(user_id)
+                replies = await pipe.execute()
+            users = [
+                parse_user(user_id, fields, legacy)
+                for user_id, fields, legacy in zip(user_ids, replies[0::2], replies[1::2])
+            ]
+            yield [user for user in users if user is not None]
+        if cursor == 0:
+            break
 
 
-def get_all_users() -> list[TelegramUser]:
+async def get_all_users() -> list[TelegramUser]:
     """Get all users from the Redis database.
     """
-    redis = redis_user_db
-    keys = redis.keys('*')
-    return [
-        get_user_from_redis(key.decode('utf-8'))
-        for key in keys
-    ]
+    all_users = list()
+    async for users in scan_users():
+        all_users.extend(users)
+    return all_users
     
-def save_json_to_redis(data: dict, key: str) -> None:
+async def save_json_to_redis(data: dict, key: str) -> None:
     """Save a JSON object to the Redis database.
     """
     json_data = json.dumps(data)
     redis = redis_service_db
-    redis.set(key, json_data)
+    count_redis_call('save_json')
+    await redis.set(key, json_data)
     
-def read_json_from_redis(key: str) -> dict:
+async def read_json_from_redis(key: str) -> dict:
     """Read a JSON object from the Redis database.
     """
     redis = redis_service_db
-    json_data = redis.get(key)
+    count_redis_call('read_json')
+    json_data = await redis.get(key)
     return json.loads(json_data)
+
+async def save_text_catalog_to_redis(data: dict) -> int:
+    """Save the text catalog, bump its version and announce the new version
+    to all workers. Returns the new version.
+    """
+    redis = redis_service_db
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(TEXT_SAVED_KEY, json.dumps(data))
+        pipe.incr(TEXT_VERSION_KEY)
+        count_redis_call('save_text_catalog')
+        _, version = await pipe.execute()
+    await publish_cache_update(CACHE_TEXTS)
+    return version
+
+async def read_text_catalog_from_redis(known_version: int | None = None) -> tuple[int, dict | None]:
+    """Read the text catalog version and the catalog itself.
+    If the stored version equals known_version the catalog is not
+    transferred and None is returned instead.
+    """
+    redis = redis_service_db
+    count_redis_call('read_text_version')
+    version = await redis.get(TEXT_VERSION_KEY)
+    version = int(version) if version is not None else 0
+    if known_version is not None and version == known_version:
+        return version, None
+    count_redis_call('read_text_catalog')
+    json_data = await redis.get(TEXT_SAVED_KEY)
+    if json_data is None:
+        return version, None
+    return version, json.loads(json_data)
+
+
+def _cache_update_message(cache: str) -> str:
+    return f"{cache}:{WORKER_ID}"
+
+
+async def publish_cache_update(cache: str) -> None:
+    """Tell the other workers that the cached data changed.
+    """
+    count_redis_call('publish_cache_update')
+    await redis_service_db.publish(CACHE_UPDATES_CHANNEL, _cache_update_message(cache))
+
+
+def parse_cache_update(message: bytes) -> str | None:
+    """Name of the changed cache, None for the announcements of this worker.
+    """
+    cache, _, worker_id = message.decode('utf-8').partition(':')
+    if worker_id == WORKER_ID:
+        return None
+    return cache
+
+
+def _check_in_mark_key(nickname: str, mark: str) -> str:
+    return f"{CHECK_IN_MARK_KEY}:{nickname}:{mark}"
+
+
+def _activation_mark(row_id: int) -> str:
+    # A row id alone is not stable, inserted or deleted rows move another member onto it
+    return f"activated:{row_id}"
+
+
+async def read_check_in_marks(nickname: str, row_id: int, day: str) -> tuple[bool, bool]:
+    """Whether any worker activated the member's membership in the row
+    and whether the member was punched on the day, in one MGET.
+    """
+    count_redis_call('read_check_in_marks')
+    activated, punched = await redis_service_db.mget(
+        _check_in_mark_key(nickname, _activation_mark(row_id)),
+        _check_in_mark_key(nickname, day),
+    )
+    return activated is not None, punched is not None
+
+
+async def save_activation_mark(nickname: str, row_id: int) -> None:
+    """Record an activation of the member's membership in the row for the
+    other workers, their copies of the sheet may not have it yet.
+    """
+    count_redis_call('save_check_in_mark')
+    await redis_service_db.set(_check_in_mark_key(nickname, _activation_mark(row_id)), 1, ex=CHECK_IN_MARK_TTL)
+
+
+async def save_punch_mark(nickname: str, day: str) -> None:
+    """Record a punch of the member on the day for the other workers."""
+    count_redis_call('save_check_in_mark')
+    await redis_service_db.set(_check_in_mark_key(nickname, day), 1, ex=CHECK_IN_MARK_TTL)
@@ -0,0 +1,31 @@
+import asyncio
+
+from kvira_space_bot_src import metrics
+
+
+class SingleFlight:
+    """Concurrent calls for the same key share one in-flight call
+    and get its result or its exception.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = dict()
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    async def do(self, key: str, func, *args, fresh: bool = False, **kwargs):
+        """Await func(*args, **kwargs), or the call for the key already in flight.
+        With fresh=True the caller does not join a call that started before it,
+        a new call is made and the later callers join that one.
+        """
+        future = self._calls.get(key)
+        if future is None or fresh:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            metrics.single_flight_joined.inc(key=key)
+        # A cancelled caller must not cancel the call the others wait for
+        return await asyncio.shield(future)
@@ -1,6 +1,8 @@
 import os
+import time
+import threading
 from datetime import datetime
-import pandas as pd
+from typing import TYPE_CHECKING
 import gspread
 from datetime import datetime, timedelta
 import logging
@@ -8,11 +10,39 @@ from kvira_space_bot_src.spreadsheets.data import (UserPassType,
                                                    ValidationResult,
                                                    DateStorageError,
                                                    WorkingMembership,
-                                                   Lang
+                                                   UsersSnapshot,
+                                                   NicknameIndex,
+                                                   MembershipRow,
+                                                   Punches,
+                                                   Lang,
+                                                   USERS_COLUMNS
 )
+from kvira_space_bot_src.metrics import sheets_call
+
+if TYPE_CHECKING:
+    # pandas is only imported for the dataframe helpers, the bot does not need it
+    import pandas as pd
 
 USERS_SHEET_NAME = 'Memberships-bot'
 TEXTS_SHEET_NAME = 'Prompts-bot'
+# tg_nickname, pass_type, date_activated, exparation_date, punches
+USERS_SHEET_RANGE = 'A:E'
+
+# How long (in seconds) the in-process copy of the users sheet is served
+# before it is downloaded again.
+USERS_CACHE_TTL = float(os.environ.get('USERS_CACHE_TTL', 60))
+# Deadline in seconds of every HTTP request to Google. Writes are awaited
+# until their thread returns, this bounds how long that takes.
+SHEETS_HTTP_TIMEOUT = float(os.environ.get('SHEETS_HTTP_TIMEOUT', 30))
+
+_users_snapshot: UsersSnapshot | None = None
+
+# Long lived gspread objects. The client keeps its credentials and HTTP session,
+# worksheet handles are cached by title so reads and writes skip the metadata calls.
+_gc: gspread.Client | None = None
+_table: gspread.Spreadsheet | None = None
+_worksheets: dict[str, gspread.Worksheet] = dict()
+_gc_lock = threading.Lock()
 
 
 if not os.environ.get('KVIRA_BOT_TESTS_ENV'):
@@ -30,42 +60,250 @@ def process_punches_from_string(punches: str) -> list:
     punches_list = [ punch.strip() for punch in punches_list ]
     return punches_list
 
-def get_gc():
-    gc = gspread.service_account(filename=GOOGLE_KEY_FILE_PATH)
-    return gc
+def get_gc() -> gspread.Client:
+    """Get the shared gspread client. It is created once and reused,
+    so credentials and the HTTP session survive between calls.
+    """
+    global _gc
+    with _gc_lock:
+        if _gc is None:
+            _gc = gspread.service_account(filename=GOOGLE_KEY_FILE_PATH)
+            _gc.set_timeout(SHEETS_HTTP_TIMEOUT)
+        return _gc
 
-def get_users_sheet():
+def get_table() -> gspread.Spreadsheet:
+    """Get the shared spreadsheet handle.
+    """
+    global _table
     gc = get_gc()
-    table = gc.open_by_key(GOOGLE_DOC_ID)
-    worksheet_list = table.worksheets()
-    # Find sheet with title USERS_SHEET_NAME
-    sheet = None
-    for worksheet in worksheet_list:
-        if worksheet.title == USERS_SHEET_NAME:
-            sheet = worksheet
-            break
+    with _gc_lock:
+        if _table is None:
+            _table = gc.open_by_key(GOOGLE_DOC_ID)
+        return _table
+
+def get_worksheet(title: str) -> gspread.Worksheet | None:
+    """Get the worksheet with the given title.
+    The handle is cached, the spreadsheet metadata is only fetched when the
+    title is not cached yet. Returns None if there is no such worksheet.
+    """
+    sheet = _worksheets.get(title)
+    if sheet is None:
+        try:
+            sheet = get_table().worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            logging.error(f"Worksheet {title} not found")
+            return None
+        _worksheets[title] = sheet
     return sheet
 
-def get_user_data_pandas() -> pd.DataFrame:
-    """Get all user data from the spreadsheet.
+def forget_worksheet(title: str) -> None:
+    """Drop the cached handle so the next call resolves the worksheet again.
+    """
+    _worksheets.pop(title, None)
+
+def _require_worksheet(title: str) -> gspread.Worksheet:
+    sheet = get_worksheet(title)
+    if sheet is None:
+        raise gspread.exceptions.WorksheetNotFound(title)
+    return sheet
+
+def with_worksheet(title: str, action):
+    """Run action(sheet) on the cached worksheet handle.
+    If Google does not know the cached worksheet anymore (it was renamed,
+    deleted or recreated) the handle is resolved again and the action retried once.
+    Raises WorksheetNotFound if the spreadsheet has no such worksheet.
+    """
+    try:
+        return action(_require_worksheet(title))
+    except gspread.exceptions.APIError as e:
+        if e.code not in (400, 404):
+            raise
+        logging.warning(f"Cached worksheet {title} is stale, resolving it again: {e}")
+        forget_worksheet(title)
+        return action(_require_worksheet(title))
+
+def get_users_sheet():
+    return get_worksheet(USERS_SHEET_NAME)
+
+def rows_from_values(values: list[list[str]]) -> list[MembershipRow]:
+    """Turn the cells of the users sheet (header first) into rows.
+    Rows without tg_nickname are skipped, row_id stays the sheet position.
+    """
+    if not values:
+        return []
+    header = values[0]
+    positions = [header.index(column) if column in header else None for column in USERS_COLUMNS]
+    rows = list()
+    for row_id, cells in enumerate(values[1:]):
+        row = [cells[position] if position is not None and position < len(cells) else '' for position in positions]
+        if row[0] == '':
+            continue
+        rows.append(MembershipRow(row_id, *row))
+    return rows
+
+def rows_from_dataframe(df: 'pd.DataFrame') -> list[MembershipRow]:
+    """Rows of a users dataframe, row_id is the dataframe index."""
+    return [MembershipRow.from_record(row_id, record) for row_id, record in zip(df.index, df.to_dict('records'))]
+
+def rows_to_dataframe(rows: list[MembershipRow]) -> 'pd.DataFrame':
+    """Users dataframe indexed by row_id, for analytics."""
+    import pandas as pd
+    return pd.DataFrame(
+        [row.to_dict() for row in rows],
+        index=[row.row_id for row in rows],
+        columns=list(USERS_COLUMNS),
+    )
+
+@sheets_call
+def get_user_rows() -> list[MembershipRow]:
+    """Get all user rows from the spreadsheet.
     """
     sheet = get_users_sheet()
-    # return pd.DataFrame(sheet.get_all_records())
-    values = sheet.get_values()
-    df = pd.DataFrame(values[1:], columns=values[0])
-    # Drop all rows where tg_nickname is empty
-    df = df.dropna(subset=['tg_nickname'])
-    return df
-
-def find_user_in_df(username: str, df: pd.DataFrame) -> pd.DataFrame:
+    # Only the columns the bot uses are downloaded
+    return rows_from_values(sheet.get_values(USERS_SHEET_RANGE))
+
+def get_user_data_pandas() -> 'pd.DataFrame':
+    """Get all user data from the spreadsheet as a dataframe.
+    Only for analytics, the bot works with get_user_rows.
+    """
+    return rows_to_dataframe(get_user_rows())
+
+def get_users_snapshot(force_refresh: bool = False, keep_current: bool = False) -> UsersSnapshot:
+    """Get the cached copy of the users sheet.
+    The sheet is downloaded again if the copy is older than USERS_CACHE_TTL,
+    was invalidated by a write or if force_refresh is set.
+    keep_current serves an expired copy instead, it is used while local
+    writes are not in the sheet yet. If the download fails the expired
+    copy is served too, unless force_refresh is set.
+    """
+    global _users_snapshot
+    snapshot = None if force_refresh else cached_users_snapshot(keep_current)
+    if snapshot is None:
+        downloaded_at = time.time()
+        try:
+            rows = get_user_rows()
+        except Exception as e:
+            snapshot = None if force_refresh else _users_snapshot
+            if snapshot is None:
+                raise
+            logging.error(f"Users sheet can not be read, serving the copy from {time.time() - snapshot.downloaded_at:.0f}s ago: {e}")
+            return snapshot
+        snapshot = UsersSnapshot(
+            rows=rows, loaded_at=time.monotonic(), index=build_nickname_index(rows), downloaded_at=downloaded_at,
+        )
+        _users_snapshot = snapshot
+        logging.info(f"Users snapshot reloaded, {len(snapshot.rows)} rows")
+    return snapshot
+
+def cached_users_snapshot(keep_current: bool = False) -> UsersSnapshot | None:
+    """The cached users sheet if get_users_snapshot can serve it
+    without a download, None otherwise.
+    """
+    snapshot = _users_snapshot
+    if snapshot is None:
+        return None
+    if time.monotonic() - snapshot.loaded_at > USERS_CACHE_TTL and not keep_current:
+        return None
+    return snapshot
+
+def restore_users_snapshot(rows: list[MembershipRow], downloaded_at: float) -> bool:
+    """Serve rows saved earlier as the cached users sheet until it is read again.
+    The copy keeps its age, one older than USERS_CACHE_TTL is downloaded again
+    on the next read and only served while Google does not answer.
+    Does nothing if the sheet was read already. Returns True if restored.
+    """
+    global _users_snapshot
+    if _users_snapshot is not None:
+        return False
+    age = max(time.time() - downloaded_at, 0)
+    _users_snapshot = UsersSnapshot(
+        rows=rows, loaded_at=time.monotonic() - age, index=build_nickname_index(rows), downloaded_at=downloaded_at,
+    )
+    return True
+
+def get_user_data_cached(force_refresh: bool = False) -> list[MembershipRow]:
+    """Same as get_user_rows but served from the in-process snapshot.
+    """
+    return get_users_snapshot(force_refresh=force_refresh).rows
+
+def invalidate_users_snapshot() -> None:
+    """Drop the cached users sheet so the next read goes to Google.
+    Must be called after every write to the users sheet.
+    """
+    global _users_snapshot
+    _users_snapshot = None
+
+def expire_users_snapshot() -> None:
+    """Make the cached users sheet count as expired, used when another worker
+    changed the sheet. Unlike invalidate_users_snapshot the copy is still
+    served with keep_current.
+    """
+    snapshot = _users_snapshot
+    if snapshot is not None:
+        snapshot.loaded_at = float('-inf')
+
+def build_nickname_index(rows: 'list[MembershipRow] | pd.DataFrame') -> NicknameIndex:
+    """Build the tg_nickname -> row positions lookup for the rows.
+    Done once per sheet load, the index shares the rows list.
+    """
+    if not isinstance(rows, list):
+        rows = rows_from_dataframe(rows)
+    index = NicknameIndex(rows=rows)
+    for position, row in enumerate(index.rows):
+        index.positions.setdefault(row.tg_nickname, []).append(position)
+    index.row_positions = {row.row_id: position for position, row in enumerate(index.rows)}
+    return index
+
+def get_snapshot_membership(row_id: int) -> WorkingMembership | None:
+    """Get the current state of the membership in the row from the cached users sheet.
+    """
+    snapshot = _users_snapshot
+    if snapshot is None or row_id not in snapshot.index.row_positions:
+        return None
+    row = snapshot.index.rows[snapshot.index.row_positions[row_id]]
+    return WorkingMembership(
+        row_id=row_id,
+        activated=row.date_activated != '',
+        membership_data=row,
+        punches=row.punches,
+    )
+
+def _replace_snapshot_row(row_id: int, **changes) -> None:
+    """Swap the row of the cached users sheet for a changed copy.
+    Memberships already handed out keep the row they were found with.
+    """
+    snapshot = _users_snapshot
+    if snapshot is None or row_id not in snapshot.index.row_positions:
+        return
+    position = snapshot.index.row_positions[row_id]
+    snapshot.index.rows[position] = snapshot.index.rows[position].replace(**changes)
+
+def update_users_snapshot_cell(row_id: int, column: str, value: str) -> None:
+    """Change one value of the cached users sheet.
+    Used to show queued writes before they reach Google.
+    """
+    _replace_snapshot_row(row_id, **{column: value})
+
+def add_punch_to_snapshot(row_id: int, day: str) -> None:
+    """Append a punch to the row of the cached users sheet.
+    """
+    snapshot = _users_snapshot
+    if snapshot is None or row_id not in snapshot.index.row_positions:
+        return
+    row = snapshot.index.rows[snapshot.index.row_positions[row_id]]
+    _replace_snapshot_row(row_id, punches=row.punches.with_day(day))
+
+def find_user_in_df(username: str, df: 'pd.DataFrame', index: NicknameIndex | None = None) -> 'pd.DataFrame':
     """Find all rows where tg_nickname == username
     """
+    if index is not None:
+        return df.iloc[index.positions.get(username, [])]
     return df[df['tg_nickname'] == username]
 
 def process_error_in_username(username: str) -> None:
     pass
 
-def validate_membership_row(row: pd.Series) -> bool:
+def validate_membership_row(row: MembershipRow | dict) -> bool:
     """Check if all date rows are in the correct format.
     Returns status of validation and list of errors
     """
@@ -84,104 +322,145 @@ def validate_membership_row(row: pd.Series) -> bool:
                 datetime.strptime(row[column], '%d.%m.%Y')
             except (ValueError, TypeError) as e:
                 process_error_in_username(row['tg_nickname'])
-                error = DateStorageError(f"Error in {column} for user {row['tg_nickname']}. Value: {row[column]}, error {e}", row.to_dict())
+                error = DateStorageError(f"Error in {column} for user {row['tg_nickname']}. Value: {row[column]}, error {e}", dict(row))
                 errors.append(error)
     if len(errors) > 0:
         return ValidationResult(result=False, validation_erros=errors)
     return ValidationResult(result=True, validation_erros=errors)
 
-def find_working_membership(username, df: pd.DataFrame, current_date: str | None = None) -> WorkingMembership:
+def _working_state(row: MembershipRow, current_date: datetime) -> tuple[list[DateStorageError], bool | None]:
+    """Validation errors of the row and whether it is a working membership:
+    False if valid but not activated yet, True if activated, within 30 days
+    and not used up, None if it is not a working membership.
+    """
+    # On this step current date should be compared with activation date + 30 days
+    # All dates in format dd.mm.yyyy
+    # If current date is bigger than activation date + 30 days - pass
+    # If current date is less than activation date + 30 days - return row
+    validation_result: ValidationResult = validate_membership_row(row)
+    if not validation_result.result:
+        logging.error(f"Error(s) encountered during validation of {row.tg_nickname} entery")
+        return validation_result.validation_erros, None
+    activation_date = row['date_activated']
+    if activation_date == '' or activation_date == None:
+        # Pass has not been activated yet! But is valid
+        return [], False
+    activation_date = datetime.strptime(activation_date, '%d.%m.%Y')
+    exparation_date = activation_date + timedelta(days=30)
+    if current_date < exparation_date:
+        # This means that row is valid in 30 days period
+        # Now lets check if user has any punches
+        if row.punches.count < UserPassType.get_days_count(row.pass_type):
+            return [], True
+    return [], None
+
+def _parse_current_date(current_date: str | None) -> datetime:
+    if current_date is None:
+        return datetime.now()
+    return datetime.strptime(current_date, '%d.%m.%Y')
+
+def find_working_membership(username, rows: 'list[MembershipRow] | pd.DataFrame', current_date: str | None = None, index: NicknameIndex | None = None) -> WorkingMembership:
     """Find all rows where tg_nickname == username
     Return WorkingMembership object with row_id and errors
-    row_id is the index of the row in the dataframe
+    row_id is the row_id of the row (the index for a dataframe)
     errors is a list of DateStorageError objects which will be used to notify admins about the errors
+    index is the prebuilt NicknameIndex of rows, it is built on the fly if not given
     """
     errors = list()
-    if current_date is None:
-        current_date = datetime.now()
-    else:
-        current_date = datetime.strptime(current_date, '%d.%m.%Y')
-    user_df = find_user_in_df(username, df)
-    if len(user_df) > 0:
-        for index, row in user_df.iterrows():
-            # On this step current date should be compared with activation date + 30 days
-            # All dates in format dd.mm.yyyy
-            # If current date is bigger than activation date + 30 days - pass
-            # If current date is less than activation date + 30 days - return row
-            validation_result: ValidationResult = validate_membership_row(row)
-            if not validation_result.result:
-                errors.extend(validation_result.validation_erros)
-                logging.error(f"Error(s) encountered during validation of {username} entery")
-            else:
-                activation_date = row['date_activated']
-                print(f"Activation date: '{activation_date}', ({activation_date != ''})")
-                if activation_date == '' or activation_date == None:
-                    # Pass has not been activated yet! But is valid
-                    return WorkingMembership(row_id=index, activated=False, errors=errors, membership_data=row.to_dict())
-                else:
-                    activation_date = datetime.strptime(activation_date, '%d.%m.%Y')
-                    exparation_date = activation_date + timedelta(days=30)
-                    if current_date < exparation_date:
-                        # This means that row is valid in 30 days period
-                        # Now lets check if user has any punches
-                        punches = row['punches']
-                        if punches == '' or punches:
-                            num_punches = len(punches.split(','))
-                            if num_punches < UserPassType.get_days_count(row['pass_type']):
-                                membership_data = row.to_dict()
-                                return WorkingMembership(row_id=index, activated=True, errors=errors, membership_data=membership_data)
+    current_date = _parse_current_date(current_date)
+    if index is None:
+        index = build_nickname_index(rows)
+    for position in index.positions.get(username, []):
+        row = index.rows[position]
+        row_errors, activated = _working_state(row, current_date)
+        errors.extend(row_errors)
+        if activated is not None:
+            return WorkingMembership(row_id=row.row_id, activated=activated, errors=errors, membership_data=row, punches=row.punches)
     return WorkingMembership(row_id=None, activated=None, errors=errors, membership_data=None)
 
+def find_working_memberships_bulk(rows: 'list[MembershipRow] | pd.DataFrame', current_date: str | None = None) -> dict[str, WorkingMembership]:
+    """Resolve the working membership of every tg_nickname in one pass over the rows.
+    Gives the same answer as calling find_working_membership for each nickname.
+    """
+    if not isinstance(rows, list):
+        rows = rows_from_dataframe(rows)
+    current_date = _parse_current_date(current_date)
+    errors: dict[str, list[DateStorageError]] = dict()
+    found: dict[str, WorkingMembership] = dict()
+    for row in rows:
+        nickname = row.tg_nickname
+        if nickname in found:
+            # Like the lookup of one user, rows after the working one are not checked
+            continue
+        nickname_errors = errors.setdefault(nickname, [])
+        row_errors, activated = _working_state(row, current_date)
+        nickname_errors.extend(row_errors)
+        if activated is not None:
+            found[nickname] = WorkingMembership(
+                row_id=row.row_id, activated=activated, errors=nickname_errors, membership_data=row, punches=row.punches,
+            )
+    return {
+        nickname: found.get(nickname) or WorkingMembership(row_id=None, activated=None, errors=nickname_errors, membership_data=None)
+        for nickname, nickname_errors in errors.items()
+    }
+
 
-def activate_membership(membership: WorkingMembership, current_date: str | None = None) -> bool:
-    """Activate pass if it was not activated yet.
+@sheets_call
+def write_pending_changes(changes: dict[int, list[tuple[str, str, str]]]) -> None:
+    """Write queued changes to the users sheet.
+    changes maps row_id to an ordered list of (column, date, tg_nickname) operations
+    where column is 'date_activated' (value is set) or 'punches' (date is appended).
+    Costs one batch_get for the current cells and one batch_update.
+    Row ids come from copies of the sheet that may be old: an operation is
+    skipped if the row holds another nickname by now, so a row inserted or
+    deleted meanwhile never moves it to another member.
+    The write is idempotent, so it can be retried when the answer to
+    batch_update was lost: a day already in the punches is not added again
+    and an activation date is only written into an empty cell.
     """
-    if membership.activated:
-        return True
-    if current_date is None:
-        current_date = datetime.now().strftime('%d.%m.%Y')
-    else:
-        current_date = datetime.strptime(current_date, '%d.%m.%Y')
-    sheet = get_users_sheet()
-    row_number = membership.row_id + 2
-    sheet.update_cell(row_number, 3, current_date)
-    return True
+    def write(sheet):
+        row_ids = list(changes)
+        # tg_nickname (A) to punches (E) of every changed row
+        value_ranges = sheet.batch_get([f"A{row_id + 2}:E{row_id + 2}" for row_id in row_ids])
+        current = dict()
+        for row_id, value_range in zip(row_ids, value_ranges):
+            cells = list(value_range[0]) if value_range and value_range[0] else []
+            cells += [''] * (5 - len(cells))
+            current[row_id] = (cells[0], cells[2], cells[4])
+        updates = list()
+        for row_id, ops in changes.items():
+            row_number = row_id + 2
+            nickname, date_activated, punches_cell = current.get(row_id, ('', '', ''))
+            punches = Punches.from_string(punches_cell)
+            punches_changed = False
+            for column, date, queued_nickname in ops:
+                if queued_nickname != nickname:
+                    logging.error(
+                        f"Row {row_number} holds {nickname!r} instead of {queued_nickname!r} now, "
+                        f"{column} {date} of {queued_nickname} is not written"
+                    )
+                    continue
+                if column == 'date_activated':
+                    if date_activated == '':
+                        date_activated = date
+                        updates.append({'range': f"C{row_number}", 'values': [[date]]})
+                elif not punches.has_day(date):
+                    punches = punches.with_day(date)
+                    punches_changed = True
+            if punches_changed:
+                updates.append({'range': f"E{row_number}", 'values': [[punches.to_string()]]})
+        if updates:
+            sheet.batch_update(updates, value_input_option=gspread.utils.ValueInputOption.user_entered)
+
+    with_worksheet(USERS_SHEET_NAME, write)
 
 
+@sheets_call
 def check_if_user_exists(username: str) -> bool:
     sheet = get_users_sheet()
     column_data = sheet.col_values(1)[1:]
     return username in column_data
 
-def punch_user_day(pd_row_id: int, current_date: str | None = None):
-    """Punch the user for the current day.
-    """
-    try:
-        sheet = get_users_sheet()
-        # find row number of the user
-        row_number = pd_row_id + 2
-        # get all punches
-        punches = sheet.cell(row_number, 5).value
-        if punches is None or punches == '' or punches == " ":
-            punches = []
-        else:
-            punches = punches.split(',')
-            punches = [ punch.strip() for punch in punches ]
-        # add new punch
-        if current_date is None:
-            current_date = datetime.now().strftime('%d.%m.%Y')
-        else:
-            current_date = datetime.strptime(current_date, '%d.%m.%Y')
-        punches.append(current_date)
-        # update the row
-        sheet.update_cell(row_number, 5, ', '.join(punches))
-        
-    except Exception as e:
-        logging.error(f"Error while punching the user with row id {pd_row_id}: {e}")
-        return False
-    return True
-
-
 # def get_days_left(username: str, df: pd.DataFrame | None = None,) -> int:
 #     """Days left for the user to use the pass. DEPRECATED
 #     """
@@ -193,9 +472,12 @@ def get_days_left_from_membership(membership: WorkingMembership) -> int:
     """Get days left from the WorkingMembership object.
     """
     pass_type = membership.membership_data['pass_type']
-    punches = process_punches_from_string(membership.membership_data['punches'])
-    return UserPassType.get_days_count(pass_type) - len(punches)
+    punches = membership.punches
+    if punches is None:
+        punches = Punches.from_string(membership.membership_data['punches'])
+    return UserPassType.get_days_count(pass_type) - punches.count
 
+@sheets_call
 def get_expation_date(username: str) -> str:
     """Get the expiration date of the pass for the user.
     """
@@ -208,17 +490,9 @@ def get_expation_date(username: str) -> str:
     return expation_date
 
 def get_text_sheet():
-    gc = get_gc()
-    table = gc.open_by_key(GOOGLE_DOC_ID)
-    worksheet_list = table.worksheets()
-    # Find sheet with title USERS_SHEET_NAME
-    sheet = None
-    for worksheet in worksheet_list:
-        if worksheet.title == TEXTS_SHEET_NAME:
-            sheet = worksheet
-            break
-    return sheet
+    return get_worksheet(TEXTS_SHEET_NAME)
 
+@sheets_call
 def get_message_for_user_from_google(str_id: str, lang: Lang) -> str:
     """Get message for the user from the spreadsheet prepared for the given language.
     
@@ -231,6 +505,7 @@ def get_message_for_user_from_google(str_id: str, lang: Lang) -> str:
     msg = sheet.cell(row_number, column_number).value
     return msg
 
+@sheets_call
 def get_all_text_json() -> dict:
     """Get all messages from the spreadsheet and return them as a dictionary."""
     sheet = get_text_sheet()
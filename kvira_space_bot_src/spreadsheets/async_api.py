@@ -0,0 +1,68 @@
+import logging
+import os
+import time
+
+from kvira_space_bot_src.single_flight import SingleFlight
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.scheduler import (
+    sheets_scheduler,
+    PRIORITY_READ,
+)
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from kvira_space_bot_src.spreadsheets.data import UsersSnapshot
+
+# Async facade over spreadsheets.api for the aiogram handlers.
+# Every call to Google waits for its turn in the Sheets scheduler and runs
+# in the shared thread pool, see kvira_space_bot_src.executor.
+
+# Timeout in seconds for reads of whole sheets, writes go through the write queue
+SHEETS_READ_TIMEOUT = float(os.environ.get('SHEETS_READ_TIMEOUT', 30))
+
+# Concurrent loads of the same sheet share one download
+_sheet_loads = SingleFlight()
+
+
+async def get_users_snapshot(force_refresh: bool = False, priority: int = PRIORITY_READ) -> UsersSnapshot:
+    """See api.get_users_snapshot. The current copy is kept while queued
+    writes are not in the sheet yet, otherwise a reload would hide them.
+    A cached copy is returned without queueing for the quota, concurrent
+    reloads share one download. force_refresh does not join a download
+    that started earlier, use it to read the sheet after a write.
+    Without force_refresh an expired copy is served if the download fails.
+    """
+    keep_current = write_queue.has_pending()
+    if not force_refresh:
+        snapshot = api.cached_users_snapshot(keep_current)
+        if snapshot is not None:
+            return snapshot
+    try:
+        return await _sheet_loads.do(
+            api.USERS_SHEET_NAME,
+            sheets_scheduler.call,
+            api.get_users_snapshot,
+            force_refresh=True,
+            priority=priority,
+            timeout=SHEETS_READ_TIMEOUT,
+            fresh=force_refresh,
+        )
+    except Exception as e:
+        snapshot = None if force_refresh else api.cached_users_snapshot(keep_current=True)
+        if snapshot is None:
+            raise
+        logging.error(f"Users sheet can not be read, serving the copy from {time.time() - snapshot.downloaded_at:.0f}s ago: {e}")
+        return snapshot
+
+
+async def get_all_text_json(priority: int = PRIORITY_READ, fresh: bool = False) -> dict:
+    """See api.get_all_text_json. Concurrent calls share one download
+    unless fresh is set.
+    """
+    return await _sheet_loads.do(
+        api.TEXTS_SHEET_NAME,
+        sheets_scheduler.call,
+        api.get_all_text_json,
+        priority=priority,
+        timeout=SHEETS_READ_TIMEOUT,
+        fresh=fresh,
+    )
+
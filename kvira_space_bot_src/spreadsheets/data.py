@@ -1,5 +1,9 @@
 from enum import Enum
 from dataclasses import dataclass, field
+from datetime import date, datetime
+
+# Format of all dates stored in the spreadsheet
+SHEET_DATE_FORMAT = '%d.%m.%Y'
 
 class UserPassType(Enum):
     """Types of passes that the user can have.
@@ -37,14 +41,160 @@ class DateStorageError:
     error_message: str
     row_data: dict | None = None
     
+class Punches:
+    """Parsed punches cell of a membership row, e.g. "6.06.2024, 7.06.2024".
+    Days are kept as sorted date ordinals. Tokens which are not valid dates
+    still count as used days. raw is the cell value as it is in the sheet.
+    """
+    __slots__ = ('raw', 'days', 'count', '_day_set')
+
+    def __init__(self, raw: str = '', days: tuple[int, ...] = (), count: int = 0):
+        self.raw = raw
+        self.days = days
+        self.count = count
+        self._day_set = frozenset(days)
+
+    @classmethod
+    def from_string(cls, raw: str | None) -> 'Punches':
+        if not isinstance(raw, str) or raw.strip() == '':
+            return cls()
+        tokens = [token.strip() for token in raw.split(',')]
+        tokens = [token for token in tokens if token]
+        days = list()
+        for token in tokens:
+            try:
+                days.append(datetime.strptime(token, SHEET_DATE_FORMAT).toordinal())
+            except ValueError:
+                pass
+        return cls(raw, tuple(sorted(days)), len(tokens))
+
+    def has_day(self, day: date | str) -> bool:
+        if isinstance(day, str):
+            day = datetime.strptime(day, SHEET_DATE_FORMAT).date()
+        return day.toordinal() in self._day_set
+
+    @property
+    def last(self) -> date | None:
+        """Latest punched day, None if there are no valid punches."""
+        if not self.days:
+            return None
+        return date.fromordinal(self.days[-1])
+
+    def with_day(self, day: date | str) -> 'Punches':
+        """New Punches with one more day appended to the sheet value."""
+        if isinstance(day, str):
+            day = datetime.strptime(day, SHEET_DATE_FORMAT).date()
+        day_str = day.strftime(SHEET_DATE_FORMAT)
+        raw = f"{self.raw.rstrip()}, {day_str}" if self.count > 0 else day_str
+        return Punches(raw, tuple(sorted(self.days + (day.toordinal(),))), self.count + 1)
+
+    def to_string(self) -> str:
+        return self.raw
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __repr__(self) -> str:
+        return f"Punches({self.raw!r})"
+
+# Columns of the users sheet the bot reads, in sheet order
+USERS_COLUMNS = ('tg_nickname', 'pass_type', 'date_activated', 'exparation_date', 'punches')
+
+
+class MembershipRow:
+    """One row of the users sheet.
+    row_id is the position of the row under the header (sheet row - 2),
+    punches is parsed once when the row is read.
+    row['column'] gives the cell value as it is in the sheet, so a row can be
+    used where a dict of the row is expected. Rows of a snapshot are shared
+    with the memberships found in it, use replace() instead of changing them.
+    """
+    __slots__ = ('row_id', 'tg_nickname', 'pass_type', 'date_activated', 'exparation_date', 'punches')
+
+    def __init__(
+        self,
+        row_id: int | None,
+        tg_nickname: str = '',
+        pass_type: str = '',
+        date_activated: str = '',
+        exparation_date: str = '',
+        punches: Punches | str = '',
+    ):
+        self.row_id = row_id
+        self.tg_nickname = tg_nickname
+        self.pass_type = pass_type
+        self.date_activated = date_activated
+        self.exparation_date = exparation_date
+        self.punches = punches if isinstance(punches, Punches) else Punches.from_string(punches)
+
+    @classmethod
+    def from_record(cls, row_id: int | None, record: dict) -> 'MembershipRow':
+        return cls(row_id, *(record.get(column, '') for column in USERS_COLUMNS))
+
+    def replace(self, **changes) -> 'MembershipRow':
+        """Copy of the row with some cells changed, punches may be given as a string."""
+        values = {column: getattr(self, column) for column in USERS_COLUMNS}
+        values.update(changes)
+        return MembershipRow(self.row_id, **values)
+
+    def keys(self) -> tuple[str, ...]:
+        return USERS_COLUMNS
+
+    def __getitem__(self, column: str):
+        if column not in USERS_COLUMNS:
+            raise KeyError(column)
+        if column == 'punches':
+            return self.punches.raw
+        return getattr(self, column)
+
+    def get(self, column: str, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> dict:
+        return {column: self[column] for column in USERS_COLUMNS}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, MembershipRow):
+            return NotImplemented
+        return self.row_id == other.row_id and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"MembershipRow({self.row_id!r}, {self.to_dict()!r})"
+
 @dataclass
 class WorkingMembership():
     """Class to store all working memberships.
+    membership_data is the row of the membership, a MembershipRow or a plain dict.
     """
     row_id: int | None = None
     activated: bool | None = None
-    membership_data: dict | None = None
+    membership_data: MembershipRow | dict | None = None
     errors: list = field(default_factory=lambda: list())
+    punches: Punches | None = None
+
+@dataclass
+class NicknameIndex:
+    """Lookup table from tg_nickname to the positions of its rows.
+    rows are the rows of the source sheet in sheet order.
+    """
+    positions: dict[str, list[int]] = field(default_factory=lambda: dict())
+    rows: list[MembershipRow] = field(default_factory=lambda: list())
+    # row_id -> position, used to patch rows after local writes
+    row_positions: dict = field(default_factory=lambda: dict())
+
+@dataclass
+class UsersSnapshot:
+    """In-process copy of the users sheet.
+    loaded_at is a time.monotonic() timestamp used for expiry,
+    downloaded_at the time.time() the download of the rows from Google started.
+    """
+    rows: list[MembershipRow]
+    loaded_at: float
+    index: NicknameIndex | None = None
+    downloaded_at: float = 0.0
 
 class Lang(Enum):
     """Language enum for the message to be sent to the user.
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+
+import gspread
+import requests
+
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.executor import run_blocking
+from kvira_space_bot_src.metrics import count_redis_call
+from kvira_space_bot_src.redis_tools import get_redis_service_db
+
+# All Google Sheets calls go through one scheduler, which keeps them within
+# the API quota. Waiting calls are served by priority, then in arrival order.
+# The quota is per Google account, so the token bucket lives in Redis and
+# all workers take their tokens from it.
+
+# Google allows 60 requests per minute per user of a project,
+# the service account is one user.
+SHEETS_REQUESTS_PER_MINUTE = float(os.environ.get('SHEETS_REQUESTS_PER_MINUTE', 60))
+# Requests that can be sent at once after an idle period
+SHEETS_REQUESTS_BURST = float(os.environ.get('SHEETS_REQUESTS_BURST', 10))
+# Retries of a call failed with 429 or a server error
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', 5))
+# First backoff delay and its upper bound in seconds
+SHEETS_BACKOFF_BASE = float(os.environ.get('SHEETS_BACKOFF_BASE', 1))
+SHEETS_BACKOFF_MAX = float(os.environ.get('SHEETS_BACKOFF_MAX', 32))
+
+# Lower value is served first
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_WRITE: 'write', PRIORITY_READ: 'read', PRIORITY_BACKGROUND: 'background'}
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Redis hash with the token bucket shared by all workers, empty keeps it per process
+SHEETS_QUOTA_KEY = os.environ.get('SHEETS_QUOTA_KEY', 'sheets_quota')
+
+# Refills the bucket and takes the tokens if there are enough.
+# Returns 0 if they were taken, otherwise the milliseconds until there are enough.
+# ARGV: rate per second, burst, cost, now in seconds. A negative cost drains the bucket.
+_TAKE_TOKENS_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+local wait = 0
+if cost < 0 then
+    tokens = math.min(tokens, 0)
+elseif tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 60)
+return wait
+"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Quota exhaustion, Google server errors and dropped connections."""
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class SheetsScheduler:
+    """Token bucket over the Sheets quota with a priority queue in front of it.
+    With quota_key the bucket is the Redis hash shared by all workers,
+    the process keeps its own one while Redis does not answer.
+    Calls run in the shared thread pool, failed ones are retried with
+    exponential backoff and full jitter.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = SHEETS_REQUESTS_PER_MINUTE,
+        burst: float = SHEETS_REQUESTS_BURST,
+        max_retries: int = SHEETS_MAX_RETRIES,
+        backoff_base: float = SHEETS_BACKOFF_BASE,
+        backoff_max: float = SHEETS_BACKOFF_MAX,
+        quota_key: str | None = None,
+    ):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.quota_key = quota_key
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        # [priority, arrival, cost, future]
+        self._waiting: list = list()
+        self._arrival = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _report_depth(self) -> None:
+        metrics.sheets_queue_depth.set(len(self._waiting))
+
+    async def _take(self, cost: float) -> float:
+        """Take cost tokens if the bucket has them. Returns 0 if taken,
+        otherwise the seconds until it has enough. A negative cost drains the bucket.
+        """
+        if self.quota_key:
+            try:
+                count_redis_call('sheets_quota')
+                wait_ms = await get_redis_service_db().eval(
+                    _TAKE_TOKENS_SCRIPT, 1, self.quota_key, self.rate, self.burst, cost, time.time(),
+                )
+                return int(wait_ms) / 1000
+            except Exception as e:
+                logging.warning(f"Shared Sheets quota is not available, counting in process: {e}")
+        self._refill()
+        if cost < 0:
+            self._tokens = min(self._tokens, 0)
+        elif self._tokens >= cost:
+            self._tokens -= cost
+        else:
+            return (cost - self._tokens) / self.rate
+        return 0.0
+
+    async def _dispatch(self) -> None:
+        """Hand out tokens to the waiting calls until none are left."""
+        while self._waiting:
+            entry = self._waiting[0]
+            priority, _, cost, future = entry
+            if future.done():
+                # The caller timed out or was cancelled
+                heapq.heappop(self._waiting)
+                self._report_depth()
+                continue
+            wait = await self._take(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            # Calls queued while the shared bucket was asked may be in front now
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._report_depth()
+            if future.done():
+                # Cancelled while the tokens were taken, they are not given back
+                continue
+            future.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_READ, cost: float = 1) -> float:
+        """Wait until the quota allows `cost` requests. Returns the seconds waited.
+        A cost above the burst is counted as the burst, the bucket never holds more.
+        """
+        cost = min(cost, self.burst)
+        if not self._waiting and await self._take(cost) == 0:
+            return 0.0
+        metrics.sheets_throttled.inc(priority=PRIORITY_NAMES[priority])
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, [priority, next(self._arrival), cost, future])
+        self._report_depth()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        waited = time.monotonic() - start
+        metrics.sheets_queue_wait.observe(waited, priority=PRIORITY_NAMES[priority])
+        return waited
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number attempt (from 0), full jitter."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def call(self, func, *args, priority: int = PRIORITY_READ, cost: float = 1, timeout: float | None = None, **kwargs):
+        """Run a blocking Sheets function within the quota.
+        cost is the number of API requests the function makes.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority, cost)
+            try:
+                return await run_blocking(func, *args, timeout=timeout, **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                if getattr(e, 'code', None) == 429:
+                    # Google is out of quota for everybody, not just this call
+                    await self._take(-1)
+                delay = self.backoff(attempt)
+                metrics.sheets_retries.inc(call=func.__name__)
+                logging.warning(f"Sheets call {func.__name__} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+sheets_scheduler = SheetsScheduler(quota_key=SHEETS_QUOTA_KEY)
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime
+
+from kvira_space_bot_src.locks import RedisLock
+from kvira_space_bot_src.redis_tools import CACHE_MEMBERSHIPS, publish_cache_update
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.scheduler import sheets_scheduler, PRIORITY_WRITE
+
+# Seconds between flushes of queued punches and activations to the users sheet
+SHEETS_FLUSH_INTERVAL = float(os.environ.get('SHEETS_FLUSH_INTERVAL', 3))
+# Lease of the flush lock, renewed while a flush is running,
+# and the longest a flush waits for another worker's one
+SHEETS_FLUSH_TIMEOUT = float(os.environ.get('SHEETS_FLUSH_TIMEOUT', 60))
+
+
+class SheetsWriteQueue:
+    """Write-behind queue for the users sheet.
+    Punches and activations are applied to the in-process snapshot right away
+    and written to Google every SHEETS_FLUSH_INTERVAL seconds as one batch.
+    Operations on the same row are written in the order they were queued,
+    each one carries the nickname it is for, row ids move when rows are
+    inserted or deleted.
+    Writes read the current cells first, so the flushes of all workers
+    take turns under one Redis lock.
+    """
+
+    def __init__(self, flush_interval: float = SHEETS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # row_id -> [(column, date, tg_nickname), ...] in queue order
+        self._pending: dict[int, list[tuple[str, str, str]]] = dict()
+        self._in_flight: dict[int, list[tuple[str, str, str]]] = dict()
+        self._flush_lock = asyncio.Lock()
+        self._stopped = False
+        self._stop_requested: asyncio.Event | None = None
+        self._run_task: asyncio.Task | None = None
+
+    def has_pending(self) -> bool:
+        """True while some queued change is not confirmed by Google."""
+        return bool(self._pending) or bool(self._in_flight)
+
+    def _enqueue(self, row_id: int, column: str, date: str, nickname: str) -> None:
+        self._pending.setdefault(row_id, []).append((column, date, nickname))
+
+    def punch(self, row_id: int, nickname: str, current_date: str | None = None) -> None:
+        """Queue a punch of the member's row, the write happens on the next flush.
+        """
+        if current_date is None:
+            current_date = datetime.now().strftime('%d.%m.%Y')
+        api.add_punch_to_snapshot(row_id, current_date)
+        self._enqueue(row_id, 'punches', current_date, nickname)
+
+    def activate(self, row_id: int, nickname: str, current_date: str | None = None) -> None:
+        """Queue the activation of the member's membership in the row.
+        """
+        if current_date is None:
+            current_date = datetime.now().strftime('%d.%m.%Y')
+        api.update_users_snapshot_cell(row_id, 'date_activated', current_date)
+        self._enqueue(row_id, 'date_activated', current_date, nickname)
+
+    def _requeue_in_flight(self) -> None:
+        """Put the changes of the failed batch in front of the ones queued meanwhile."""
+        for row_id, ops in self._pending.items():
+            self._in_flight.setdefault(row_id, []).extend(ops)
+        self._pending = self._in_flight
+
+    async def flush(self) -> bool:
+        """Write all queued changes with one batch. On failure or cancellation
+        the changes are put back in front of the ones queued meanwhile.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            self._in_flight, self._pending = self._pending, dict()
+            try:
+                async with RedisLock('sheets_flush', lease=SHEETS_FLUSH_TIMEOUT, wait_timeout=SHEETS_FLUSH_TIMEOUT) as lock:
+                    # One batch_get and one batch_update. A running write can not be
+                    # stopped, so it is not timed out here: the lock is kept until the
+                    # thread returns and every request has the HTTP client deadline.
+                    await lock.hold(sheets_scheduler.call(
+                        api.write_pending_changes, self._in_flight,
+                        priority=PRIORITY_WRITE, cost=2, timeout=math.inf,
+                    ))
+            except asyncio.CancelledError:
+                logging.warning(f"Flush of {len(self._in_flight)} rows to the users sheet cancelled, they stay queued")
+                self._requeue_in_flight()
+                raise
+            except Exception as e:
+                logging.error(f"Error while flushing {len(self._in_flight)} rows to the users sheet: {e}")
+                self._requeue_in_flight()
+                return False
+            finally:
+                self._in_flight = dict()
+            logging.info("Queued sheet writes flushed")
+            try:
+                await publish_cache_update(CACHE_MEMBERSHIPS)
+            except Exception as e:
+                logging.error(f"Could not announce the users sheet update: {e}")
+            return True
+
+    async def run(self) -> None:
+        """Flush periodically until stop() is called."""
+        self._run_task = asyncio.current_task()
+        self._stop_requested = asyncio.Event()
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._stop_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    async def stop(self) -> None:
+        """Stop the periodic flushing and write what is left.
+        A flush already running is finished, not cancelled.
+        """
+        self._stopped = True
+        if self._stop_requested is not None:
+            self._stop_requested.set()
+        if self._run_task is not None and not self._run_task.done():
+            await self._run_task
+        if not await self.flush():
+            logging.error(f"Unsaved sheet writes lost on shutdown: {self._pending}")
+
+
+write_queue = SheetsWriteQueue()
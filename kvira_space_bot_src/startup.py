@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.executor import run_blocking
+from kvira_space_bot_src.messaging import (
+    get_text_catalog,
+    load_text_catalog,
+    publish_text_catalog,
+    set_text_catalog,
+)
+from kvira_space_bot_src.spreadsheets import api, async_api
+from kvira_space_bot_src.spreadsheets.data import MembershipRow, USERS_COLUMNS
+
+# The bot starts serving from the last known state instead of waiting for
+# Google Sheets: the text catalog from Redis, or both the catalog and the
+# users sheet from a local snapshot file. Fresh copies are pulled in the
+# background once the bot is up.
+
+# File with the last text catalog and users sheet this worker saw, empty disables it
+LOCAL_SNAPSHOT_PATH = os.environ.get('LOCAL_SNAPSHOT_PATH', 'snapshot_data/kvira_snapshot.json')
+# Seconds between saves of the local snapshot
+LOCAL_SNAPSHOT_SAVE_INTERVAL = float(os.environ.get('LOCAL_SNAPSHOT_SAVE_INTERVAL', 300))
+# Seconds between attempts to pull the text catalog while Google does not answer
+STARTUP_REFRESH_RETRY = float(os.environ.get('STARTUP_REFRESH_RETRY', 30))
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Log how long the with block took and keep it in startup_phase_seconds."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        metrics.startup_phase_seconds.set(elapsed, phase=name)
+        logging.info(f"Startup phase {name} took {elapsed:.3f}s")
+
+
+def save_local_snapshot(
+    texts: dict, rows: list[MembershipRow] | None, path: str = LOCAL_SNAPSHOT_PATH, downloaded_at: float | None = None,
+) -> None:
+    """Write the text catalog and the users sheet rows to the snapshot file.
+    downloaded_at is when the rows were read from Google, now by default.
+    The file is replaced atomically, a crash never leaves half of it.
+    """
+    data = {'saved_at': time.time(), 'texts': texts}
+    if rows is not None:
+        data['rows'] = [[row.row_id] + [row[column] for column in USERS_COLUMNS] for row in rows]
+        data['rows_downloaded_at'] = data['saved_at'] if downloaded_at is None else downloaded_at
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, default=str)
+    os.replace(temp_path, path)
+
+
+def read_local_snapshot(path: str = LOCAL_SNAPSHOT_PATH) -> tuple[dict, list[MembershipRow] | None, float] | None:
+    """Text catalog, users sheet rows and the time the rows were read
+    from Google from the snapshot file, None if there is no readable file.
+    """
+    try:
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Local snapshot {path} can not be read: {e}")
+        return None
+    rows = None
+    if 'rows' in data:
+        rows = [MembershipRow(row[0], *row[1:]) for row in data['rows']]
+    saved_at = data.get('saved_at', 0)
+    logging.info(f"Local snapshot {path} from {time.time() - saved_at:.0f}s ago")
+    return data.get('texts') or dict(), rows, data.get('rows_downloaded_at', saved_at)
+
+
+async def restore_last_known_state() -> None:
+    """Fill the text catalog and the users sheet copy without calling Google.
+    Redis has the catalog the workers share, the local snapshot is used for
+    what Redis does not have.
+    """
+    with startup_phase('text_catalog_from_redis'):
+        try:
+            has_texts = await load_text_catalog()
+        except Exception as e:
+            logging.error(f"Text catalog can not be read from Redis: {e}")
+            has_texts = False
+    if not LOCAL_SNAPSHOT_PATH:
+        return
+    with startup_phase('local_snapshot'):
+        snapshot = await run_blocking(read_local_snapshot, LOCAL_SNAPSHOT_PATH)
+        if snapshot is None:
+            return
+        texts, rows, downloaded_at = snapshot
+        if not has_texts and texts:
+            set_text_catalog(texts)
+            logging.info(f"Text catalog restored from the local snapshot, {len(texts)} messages")
+        if rows is not None and api.restore_users_snapshot(rows, downloaded_at):
+            logging.info(f"Users sheet restored from the local snapshot, {len(rows)} rows "
+                         f"read {time.time() - downloaded_at:.0f}s ago")
+
+
+async def save_local_snapshot_now() -> None:
+    """Save the current text catalog and users sheet copy to the snapshot file."""
+    if not LOCAL_SNAPSHOT_PATH:
+        return
+    texts = get_text_catalog()
+    snapshot = api.cached_users_snapshot(keep_current=True)
+    if not texts and snapshot is None:
+        return
+    try:
+        await run_blocking(
+            save_local_snapshot, texts,
+            None if snapshot is None else list(snapshot.rows), LOCAL_SNAPSHOT_PATH,
+            None if snapshot is None else snapshot.downloaded_at,
+        )
+    except Exception as e:
+        logging.error(f"Local snapshot can not be saved: {e}")
+
+
+async def refresh_from_sheets() -> None:
+    """Pull the text catalog from Google after the bot started serving,
+    retrying until Google answers. The users sheet is pulled by the membership sync.
+    """
+    while True:
+        try:
+            with startup_phase('text_catalog_from_sheets'):
+                texts = await async_api.get_all_text_json(fresh=True)
+                await publish_text_catalog(texts)
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Text catalog can not be pulled from Google, retry in {STARTUP_REFRESH_RETRY}s: {e}")
+            await asyncio.sleep(STARTUP_REFRESH_RETRY)
+    await save_local_snapshot_now()
+
+
+async def local_snapshot_loop() -> None:
+    """Save the local snapshot every LOCAL_SNAPSHOT_SAVE_INTERVAL seconds."""
+    if not LOCAL_SNAPSHOT_PATH:
+        return
+    while True:
+        await asyncio.sleep(LOCAL_SNAPSHOT_SAVE_INTERVAL)
+        await save_local_snapshot_now()
@@ -19,7 +19,7 @@ else
 fi
 
 
-# Install requirements
-pip3 install -r "$BASEDIR/requirements.txt"
+# Install requirements, the tests need the dev ones too (fakeredis for the Redis backed tests)
+pip3 install -r "$BASEDIR/requirements.txt" -r "$BASEDIR/requirements-dev.txt"
 
 python3 -m pytest -v "$BASEDIR/test/tests"
\ No newline at end of file
@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+import pytest
+
+from kvira_space_bot_src.bot import TelegramApiBot, buttons, get_or_create_user
+from kvira_space_bot_src.spreadsheets.data import Lang
+from harness import BotHarness, summary, timed
+
+# Handler latency benchmarks, run with `make bench`.
+# BENCH_SHEETS_LATENCY injects a delay (seconds) into every fake Sheets call.
+SHEETS_LATENCY = float(os.environ.get('BENCH_SHEETS_LATENCY', 0.0))
+ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', 200))
+USERS = 1000
+
+HANDLERS = {
+    'command_start_handler': (TelegramApiBot.command_start_handler, '/start'),
+    'check_membership_handler': (TelegramApiBot.check_membership_handler, buttons[Lang.Eng.value]['check_membership']),
+    'check_in_handler': (TelegramApiBot.check_in_handler, buttons[Lang.Eng.value]['check_in']),
+}
+
+
+async def call(handler, message):
+    """Run the handler with the profile UserMiddleware would pass to it."""
+    return await handler(message, await get_or_create_user(message.from_user))
+
+
+@pytest.mark.parametrize('n_rows', [100, 10_000, 100_000])
+@pytest.mark.parametrize('handler_name', list(HANDLERS))
+def test_handler_latency(handler_name, n_rows):
+    handler, text = HANDLERS[handler_name]
+    users = min(USERS, n_rows)
+
+    async def run():
+        harness = BotHarness(n_rows=n_rows, n_users=users, sheets_latency=SHEETS_LATENCY)
+        harness.start()
+        try:
+            # First call pays for the sheet download and the index build
+            cold = await timed(call(handler, harness.message(0, text)))
+            warm = [
+                await timed(call(handler, harness.message(i % users, text)))
+                for i in range(ITERATIONS)
+            ]
+        finally:
+            await harness.stop()
+        return cold, warm
+
+    cold, warm = asyncio.run(run())
+    print(f"\n{handler_name} rows={n_rows}: cold={1000 * cold:.1f}ms warm {summary(warm)}")
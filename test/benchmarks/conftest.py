@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+# bot.py creates the Bot object on import, the token only has to look valid
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForBenchmarksOnly0000000')
+
+# The fake Google Sheets backend lives next to the unit tests
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tests'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
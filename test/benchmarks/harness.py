@@ -0,0 +1,150 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+from kvira_space_bot_src import bot as bot_module
+from kvira_space_bot_src import messaging, redis_tools
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from fake_sheets import install_fake_sheets, make_texts_sheet, make_users_sheet
+
+TEXTS = {
+    msg_type: {'eng': text, 'rus': text}
+    for msg_type, text in {
+        'hello_msg': 'Hello!',
+        'no_pass': 'You have no pass.',
+        'not_activated_pass': 'Your pass is not activated yet.',
+        'month_pass': 'You have a month pass.',
+        'days_left': 'Days left: {}',
+        'exp_date': 'Valid until {}',
+        'community_day': 'Today is the community day!',
+        'lang_changed': 'Language changed.',
+        'pass_activated': 'Your pass is activated.',
+        'already_punched': 'You are already checked in today.',
+        'pass_punched': 'Visit registered.',
+        'error_punching': 'Error, please ask the admin.',
+    }.items()
+}
+
+
+def make_membership_rows(n_rows: int, n_users: int) -> list[dict]:
+    """Sheet with n_rows passes of n_users members. The last pass of every
+    member is active, the older ones are expired history.
+    """
+    today = datetime.now()
+    expired = (today - timedelta(days=90)).strftime('%d.%m.%Y')
+    active = (today - timedelta(days=1)).strftime('%d.%m.%Y')
+    old_punches = ', '.join((today - timedelta(days=90 - day)).strftime('%d.%m.%Y') for day in range(5))
+    rows = list()
+    for i in range(n_rows):
+        is_active = i >= n_rows - n_users
+        rows.append({
+            'tg_nickname': f"user{i % n_users}",
+            'pass_type': '10day' if is_active else '5day',
+            'date_activated': active if is_active else expired,
+            'exparation_date': '',
+            'punches': '' if is_active else old_punches,
+        })
+    return rows
+
+
+class FakeTelegramSession(BaseSession):
+    """Bot session that answers every request locally after `latency` seconds.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.requests,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class BotHarness:
+    """Runs the real handlers against fake Sheets, fakeredis and a fake Telegram session.
+    """
+
+    def __init__(self, n_rows: int, n_users: int, sheets_latency: float = 0.0, telegram_latency: float = 0.0):
+        self.n_rows = n_rows
+        self.n_users = n_users
+        self.sheets_latency = sheets_latency
+        self.telegram_latency = telegram_latency
+        self.monkeypatch = pytest.MonkeyPatch()
+        self.bot = bot_module.bot
+        self.users_sheet = None
+        self.telegram_session = None
+
+    def start(self) -> None:
+        server = fakeredis.FakeServer()
+        self.monkeypatch.setattr(redis_tools, 'redis_user_db', fakeredis.FakeAsyncRedis(server=server, db=redis_tools.USER_DATA_DB))
+        self.monkeypatch.setattr(redis_tools, 'redis_service_db', fakeredis.FakeAsyncRedis(server=server, db=redis_tools.SERVICE_DATA_DB))
+        redis_tools.user_cache.clear()
+        self.users_sheet = make_users_sheet(make_membership_rows(self.n_rows, self.n_users), latency=self.sheets_latency)
+        install_fake_sheets(self.monkeypatch, self.users_sheet, make_texts_sheet(TEXTS, latency=self.sheets_latency))
+        # Keep the numbers independent of the day of the week
+        self.monkeypatch.setattr(bot_module, 'COMMUNITY_DAY', -1)
+        self.telegram_session = FakeTelegramSession(self.telegram_latency)
+        self.monkeypatch.setattr(self.bot, 'session', self.telegram_session)
+        messaging.set_text_catalog(api.get_all_text_json())
+
+    async def stop(self) -> None:
+        await write_queue.flush()
+        await messaging.wait_admin_notifications()
+        self.monkeypatch.undo()
+        api.invalidate_users_snapshot()
+
+    def message(self, user_index: int, text: str) -> Message:
+        user_id = 1_000_000 + user_index
+        return Message(
+            message_id=user_index,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name='Member', username=f"user{user_index}"),
+            text=text,
+        ).as_(self.bot)
+
+    def update(self, update_id: int, user_index: int, text: str) -> Update:
+        return Update(update_id=update_id, message=self.message(user_index, text))
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summary(samples: list[float]) -> str:
+    return (
+        f"n={len(samples)} mean={1000 * sum(samples) / len(samples):.2f}ms "
+        f"p50={1000 * percentile(samples, 0.5):.2f}ms "
+        f"p95={1000 * percentile(samples, 0.95):.2f}ms "
+        f"p99={1000 * percentile(samples, 0.99):.2f}ms"
+    )
+
+
+async def timed(coroutine) -> float:
+    start = time.perf_counter()
+    await coroutine
+    return time.perf_counter() - start
@@ -0,0 +1,137 @@
+"""Synthetic load generator for the bot.
+
+Feeds fake Telegram updates from many distinct users into the module-level
+Dispatcher (`dp.feed_update`) with a mocked Bot session, fakeredis and the
+fake Google Sheets backend, then reports handler latency and throughput.
+
+    python test/benchmarks/load_test.py --users 5000 --updates 20000 --concurrency 200 \
+        --mix check_in=0.6,check_membership=0.3,lang=0.1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForBenchmarksOnly0000000')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tests'))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+
+from kvira_space_bot_src.bot import dp, buttons
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.membership_store import membership_sync_loop, sync_memberships
+from kvira_space_bot_src.spreadsheets.data import Lang
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from harness import BotHarness, percentile
+
+BUTTONS = {
+    'check_in': buttons[Lang.Rus.value]['check_in'],
+    'check_membership': buttons[Lang.Rus.value]['check_membership'],
+    'lang': buttons[Lang.Rus.value]['lang'],
+    'start': '/start',
+}
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = dict()
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in BUTTONS:
+            raise argparse.ArgumentTypeError(f"Unknown button {name}, use one of {', '.join(BUTTONS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+async def run_load(args) -> None:
+    harness = BotHarness(
+        n_rows=args.rows,
+        n_users=args.users,
+        sheets_latency=args.sheets_latency,
+        telegram_latency=args.telegram_latency,
+    )
+    harness.start()
+    rng = random.Random(args.seed)
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    queue: asyncio.Queue = asyncio.Queue()
+    for update_id in range(args.updates):
+        button = rng.choices(names, weights)[0]
+        queue.put_nowait((update_id, rng.randrange(args.users), button))
+
+    latencies = {name: list() for name in names}
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        while True:
+            try:
+                update_id, user_index, button = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            update = harness.update(update_id, user_index, BUTTONS[button])
+            start = time.perf_counter()
+            try:
+                await dp.feed_update(harness.bot, update)
+            except Exception:
+                failures += 1
+                logging.exception(f"Update {update_id} failed")
+            latencies[button].append(time.perf_counter() - start)
+
+    background = [asyncio.create_task(write_queue.run())]
+    if not args.no_store:
+        await sync_memberships()
+        background.append(asyncio.create_task(membership_sync_loop()))
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        for task in background:
+            task.cancel()
+        await harness.stop()
+
+    all_latencies = [latency for samples in latencies.values() for latency in samples]
+    print(f"updates={args.updates} users={args.users} rows={args.rows} concurrency={args.concurrency}")
+    print(f"throughput={len(all_latencies) / elapsed:.1f} updates/s in {elapsed:.2f}s, failures={failures}")
+    print(f"sheets calls={len(harness.users_sheet.calls)} telegram requests={harness.telegram_session.requests}")
+    for name, samples in [('all', all_latencies)] + list(latencies.items()):
+        if not samples:
+            continue
+        print(
+            f"{name:>16}: n={len(samples):>6} "
+            f"p50={1000 * percentile(samples, 0.5):8.2f}ms "
+            f"p95={1000 * percentile(samples, 0.95):8.2f}ms "
+            f"p99={1000 * percentile(samples, 0.99):8.2f}ms"
+        )
+    if args.metrics:
+        print(metrics.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000, help="distinct Telegram users")
+    parser.add_argument('--rows', type=int, default=10000, help="rows in the memberships sheet")
+    parser.add_argument('--updates', type=int, default=10000, help="total updates to send")
+    parser.add_argument('--concurrency', type=int, default=100, help="updates processed at the same time")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('check_in=0.6,check_membership=0.3,lang=0.1'),
+                        help="button weights, e.g. check_in=0.6,check_membership=0.3,lang=0.1,start=0.1")
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help="seconds added to every Sheets call")
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help="seconds added to every Telegram request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-store', action='store_true',
+                        help="do not sync the Redis membership store, handlers read the sheet")
+    parser.add_argument('--metrics', action='store_true', help="also print the bot's own metrics")
+    args = parser.parse_args()
+    args.rows = max(args.rows, args.users)
+    # Per-update INFO logs would dominate the measurement
+    logging.disable(logging.INFO)
+    asyncio.run(run_load(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+import pytest
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Point redis_tools at an in-memory fakeredis server."""
+    # From requirements-dev.txt, a missing one fails the tests instead of skipping them
+    import fakeredis
+    from kvira_space_bot_src import redis_tools
+
+    server = fakeredis.FakeServer()
+    user_db = fakeredis.FakeAsyncRedis(server=server, db=redis_tools.USER_DATA_DB)
+    service_db = fakeredis.FakeAsyncRedis(server=server, db=redis_tools.SERVICE_DATA_DB)
+    monkeypatch.setattr(redis_tools, 'redis_user_db', user_db)
+    monkeypatch.setattr(redis_tools, 'redis_service_db', service_db)
+    redis_tools.user_cache.clear()
+    return service_db
+
+
+@pytest.fixture(autouse=True)
+def sheets_scheduler(monkeypatch):
+    """Fresh, effectively unthrottled Sheets scheduler for every test,
+    so quota used by one test does not slow down the next one.
+    """
+    from kvira_space_bot_src.spreadsheets import async_api, scheduler, write_queue
+
+    fresh = scheduler.SheetsScheduler(requests_per_minute=10 ** 6, burst=10 ** 6)
+    for module in (scheduler, write_queue, async_api):
+        monkeypatch.setattr(module, 'sheets_scheduler', fresh)
+    return fresh
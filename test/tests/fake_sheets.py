@@ -0,0 +1,128 @@
+import re
+import time
+
+from kvira_space_bot_src.spreadsheets import api
+
+USERS_HEADER = ['tg_nickname', 'pass_type', 'date_activated', 'exparation_date', 'punches']
+
+
+class FakeCell:
+    def __init__(self, row: int, col: int, value: str | None):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+def _column_number(letters: str) -> int:
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def _parse_a1(label: str) -> tuple[int | None, int]:
+    """'E5' -> (5, 5), 'E' -> (None, 5)"""
+    match = re.fullmatch(r"([A-Z]+)(\d*)", label)
+    col = _column_number(match.group(1))
+    row = int(match.group(2)) if match.group(2) else None
+    return row, col
+
+
+class FakeWorksheet:
+    """In-memory stand-in for the part of gspread.Worksheet used by the bot.
+    Every call sleeps `latency` seconds to imitate a round trip to Google
+    and is recorded in `calls`.
+    """
+
+    def __init__(self, title: str, values: list[list[str]], latency: float = 0.0):
+        self.title = title
+        self.values = [list(row) for row in values]
+        self.latency = latency
+        self.calls = []
+
+    def _round_trip(self, name: str) -> None:
+        self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, row: int, col: int) -> str:
+        if row - 1 < len(self.values) and col - 1 < len(self.values[row - 1]):
+            return self.values[row - 1][col - 1]
+        return ''
+
+    def _set(self, row: int, col: int, value) -> None:
+        while len(self.values) < row:
+            self.values.append([])
+        while len(self.values[row - 1]) < col:
+            self.values[row - 1].append('')
+        self.values[row - 1][col - 1] = str(value)
+
+    def _range(self, range_name: str) -> list[list[str]]:
+        start, _, end = range_name.partition(':')
+        start_row, start_col = _parse_a1(start)
+        end_row, end_col = _parse_a1(end or start)
+        start_row = start_row or 1
+        end_row = end_row or len(self.values)
+        return [
+            [self._get(row, col) for col in range(start_col, end_col + 1)]
+            for row in range(start_row, end_row + 1)
+        ]
+
+    def get_values(self, range_name: str | None = None, **kwargs) -> list[list[str]]:
+        self._round_trip('get_values')
+        if range_name is None:
+            return [list(row) for row in self.values]
+        return self._range(range_name)
+
+    def get_all_records(self, **kwargs) -> list[dict]:
+        self._round_trip('get_all_records')
+        header = self.values[0]
+        return [dict(zip(header, row)) for row in self.values[1:]]
+
+    def col_values(self, col: int, **kwargs) -> list[str]:
+        self._round_trip('col_values')
+        return [row[col - 1] if col - 1 < len(row) else '' for row in self.values]
+
+    def cell(self, row: int, col: int, **kwargs) -> FakeCell:
+        self._round_trip('cell')
+        return FakeCell(row, col, self._get(row, col))
+
+    def update_cell(self, row: int, col: int, value) -> None:
+        self._round_trip('update_cell')
+        self._set(row, col, value)
+
+    def batch_get(self, ranges, **kwargs) -> list[list[list[str]]]:
+        self._round_trip('batch_get')
+        result = list()
+        for range_name in ranges:
+            rows = self._range(range_name)
+            # Google drops empty cells from the response
+            result.append([row for row in rows if any(row)])
+        return result
+
+    def batch_update(self, data: list[dict], **kwargs) -> None:
+        self._round_trip('batch_update')
+        for item in data:
+            start_row, start_col = _parse_a1(item['range'].partition(':')[0])
+            for row_offset, row in enumerate(item['values']):
+                for col_offset, value in enumerate(row):
+                    self._set(start_row + row_offset, start_col + col_offset, value)
+
+
+def make_users_sheet(rows: list[dict], latency: float = 0.0) -> FakeWorksheet:
+    values = [USERS_HEADER] + [[str(row.get(column, '')) for column in USERS_HEADER] for row in rows]
+    return FakeWorksheet(api.USERS_SHEET_NAME, values, latency=latency)
+
+
+def make_texts_sheet(texts: dict[str, dict[str, str]], latency: float = 0.0) -> FakeWorksheet:
+    values = [['msg_type', 'eng', 'rus']] + [
+        [msg_type, text['eng'], text['rus']] for msg_type, text in texts.items()
+    ]
+    return FakeWorksheet(api.TEXTS_SHEET_NAME, values, latency=latency)
+
+
+def install_fake_sheets(monkeypatch, *sheets: FakeWorksheet) -> None:
+    """Make spreadsheets.api use the fake worksheets instead of Google."""
+    by_title = {sheet.title: sheet for sheet in sheets}
+    monkeypatch.setattr(api, 'get_worksheet', lambda title: by_title.get(title))
+    api.invalidate_users_snapshot()
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+
+class RecordingSession(BaseSession):
+    """Bot session which keeps the sent texts by chat instead of calling Telegram."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent: dict[int, list[str]] = dict()
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.sent.setdefault(method.chat_id, []).append(method.text)
+            return Message(message_id=1, date=datetime.now(), chat=Chat(id=method.chat_id, type='private'), text=method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def make_message(bot, message_id: int, user_id: int, username: str, text: str) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, is_bot=False, first_name='Member', username=username),
+        text=text,
+    ).as_(bot)
+
+
+def make_update(bot, update_id: int, user_id: int, username: str, text: str) -> Update:
+    return Update(update_id=update_id, message=make_message(bot, update_id, user_id, username, text))
@@ -0,0 +1,65 @@
+import asyncio
+
+from kvira_space_bot_src import broadcast
+from kvira_space_bot_src.locks import RedisLock
+from kvira_space_bot_src.redis_tools import BROADCAST_KEY, TelegramUser, add_user_to_redis
+from kvira_space_bot_src.spreadsheets.data import Lang
+
+
+def _fake_delivery(monkeypatch, delivered: asyncio.Event | None = None) -> list[int]:
+    sent = []
+
+    async def send_message_to_user(user_id, text, bot):
+        if delivered is not None:
+            await delivered.wait()
+        sent.append(user_id)
+        return True
+
+    monkeypatch.setattr(broadcast, 'send_message_to_user', send_message_to_user)
+    monkeypatch.setattr(broadcast, '_broadcast_task', None)
+    return sent
+
+
+async def _add_users(count: int) -> None:
+    for user_id in range(1, count + 1):
+        await add_user_to_redis(TelegramUser(user_id=str(user_id), username=f"user{user_id}", lang=Lang.Rus))
+
+
+def test_broadcast_of_a_dead_worker_is_resumed_without_the_delivered_users(monkeypatch, fake_redis):
+    sent = _fake_delivery(monkeypatch)
+    monkeypatch.setattr(broadcast, 'BROADCAST_LOCK_LEASE', 0.1)
+
+    async def run():
+        await _add_users(3)
+        # The worker died after the first user, its lease runs out
+        await fake_redis.hset(BROADCAST_KEY, mapping={'id': 'b1', 'text': 'Hi', 'status': broadcast.STATUS_RUNNING, 'sent': 1, 'failed': 0})
+        await fake_redis.sadd(broadcast._done_users_key('b1'), '1')
+        assert await RedisLock('broadcast', lease=0.15).try_acquire()
+        resume_loop = asyncio.create_task(broadcast.broadcast_resume_loop(bot=None))
+        while (await broadcast.get_broadcast_state())['status'] == broadcast.STATUS_RUNNING:
+            await asyncio.sleep(0.05)
+        resume_loop.cancel()
+        return await broadcast.get_broadcast_state()
+
+    state = asyncio.run(asyncio.wait_for(run(), 5))
+    assert sorted(sent) == [2, 3]
+    assert state['status'] == broadcast.STATUS_DONE and state['sent'] == '3'
+
+
+def test_broadcast_is_started_and_delivered_once(monkeypatch, fake_redis):
+    async def run():
+        delivered = asyncio.Event()
+        sent = _fake_delivery(monkeypatch, delivered)
+        await _add_users(3)
+        # Two admins start a broadcast at the same time
+        started = await asyncio.gather(broadcast.start_broadcast('Hi', None), broadcast.start_broadcast('Hi', None))
+        delivered.set()
+        await broadcast._broadcast_task
+        broadcast_id = next(broadcast_id for broadcast_id in started if broadcast_id is not None)
+        # A resume that read the state before the broadcast finished
+        await broadcast.run_broadcast(broadcast_id, 'Hi', None)
+        return started, sent
+
+    started, sent = asyncio.run(run())
+    assert started.count(None) == 1
+    assert sorted(sent) == [1, 2, 3]
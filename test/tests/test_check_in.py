@@ -0,0 +1,86 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForTestsOnly000000000000')
+
+from aiogram.types import Update
+
+from kvira_space_bot_src import bot as bot_module
+from kvira_space_bot_src import locks, messaging
+from kvira_space_bot_src.spreadsheets.data import Lang
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from fake_sheets import install_fake_sheets, make_users_sheet
+from fake_telegram import RecordingSession, make_update
+
+ACTIVATED = (datetime.now() - timedelta(days=1)).strftime('%d.%m.%Y')
+ROWS = [
+    {'tg_nickname': 'Dark', 'pass_type': '10day', 'date_activated': ACTIVATED, 'exparation_date': '', 'punches': ''},
+    {'tg_nickname': 'Puk', 'pass_type': '10day', 'date_activated': ACTIVATED, 'exparation_date': '', 'punches': ''},
+]
+TEXTS = {
+    msg_type: {'eng': msg_type, 'rus': msg_type}
+    for msg_type in ('pass_punched', 'already_punched', 'error_punching', 'no_pass', 'community_day')
+}
+CHECK_IN = bot_module.buttons[Lang.Eng.value]['check_in']
+
+
+def _update(update_id: int, user_id: int, username: str) -> Update:
+    return make_update(bot_module.bot, update_id, user_id, username, CHECK_IN)
+
+
+def _setup(monkeypatch) -> RecordingSession:
+    install_fake_sheets(monkeypatch, make_users_sheet(ROWS))
+    monkeypatch.setattr(bot_module, 'COMMUNITY_DAY', -1)
+    # asyncio locks are bound to the loop of the test which used them first
+    monkeypatch.setattr(locks, 'punch_locks', locks.StripedLock())
+    monkeypatch.setattr(messaging, '_text_catalog', TEXTS)
+    session = RecordingSession()
+    monkeypatch.setattr(bot_module.bot, 'session', session)
+    return session
+
+
+async def _feed(*updates: Update) -> None:
+    try:
+        await asyncio.gather(*(bot_module.dp.feed_update(bot_module.bot, update) for update in updates))
+    finally:
+        await write_queue.flush()
+        await messaging.wait_admin_notifications()
+
+
+def test_concurrent_taps_of_one_member_punch_once(monkeypatch, fake_redis):
+    session = _setup(monkeypatch)
+
+    asyncio.run(_feed(*(_update(update_id, 1, 'Dark') for update_id in range(5))))
+
+    assert sorted(session.sent[1]) == ['already_punched'] * 4 + ['pass_punched']
+
+
+def test_check_in_of_another_member_does_not_wait_for_a_busy_row(monkeypatch, fake_redis):
+    session = _setup(monkeypatch)
+    read_check_in_marks = bot_module.read_check_in_marks
+    slow_member_inside = asyncio.Event()
+    release_slow_member = asyncio.Event()
+
+    async def slow_for_dark(username, row_id, today):
+        if username == 'Dark':
+            # Hold the row lock of Dark until the other member is done
+            slow_member_inside.set()
+            await release_slow_member.wait()
+        return await read_check_in_marks(username, row_id, today)
+
+    monkeypatch.setattr(bot_module, 'read_check_in_marks', slow_for_dark)
+
+    async def run():
+        slow = asyncio.create_task(_feed(_update(1, 1, 'Dark'), _update(2, 1, 'Dark')))
+        await asyncio.wait_for(slow_member_inside.wait(), 5)
+        await asyncio.wait_for(_feed(_update(3, 2, 'Puk')), 5)
+        answered_while_busy = dict(session.sent)
+        release_slow_member.set()
+        await slow
+        return answered_while_busy
+
+    answered_while_busy = asyncio.run(run())
+
+    assert answered_while_busy == {2: ['pass_punched']}
+    assert sorted(session.sent[1]) == ['already_punched', 'pass_punched']
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from kvira_space_bot_src import redis_tools
+from kvira_space_bot_src.locks import RedisLock, LockNotAcquired
+
+
+def test_redis_lock_is_exclusive_and_released_by_owner_only(fake_redis):
+    async def run():
+        first = RedisLock('row:1', lease=5, wait_timeout=0.1)
+        second = RedisLock('row:1', lease=5, wait_timeout=0.1)
+        await first.acquire()
+        assert not await second.try_acquire()
+        with pytest.raises(LockNotAcquired):
+            await second.acquire()
+        # A stale holder must not free the lock somebody else took meanwhile
+        await fake_redis.set(first.key, second.token)
+        await first.release()
+        assert await fake_redis.get(first.key) == second.token.encode()
+        await second.release()
+        assert await first.try_acquire()
+        await first.release()
+
+    asyncio.run(run())
+
+
+def test_redis_lock_lease_expires(fake_redis):
+    async def run():
+        dead_worker = RedisLock('sheets_flush', lease=0.05)
+        assert await dead_worker.try_acquire()
+        async with RedisLock('sheets_flush', wait_timeout=1):
+            pass
+
+    asyncio.run(run())
+
+
+def test_check_in_marks_are_shared(fake_redis):
+    async def run():
+        assert await redis_tools.read_check_in_marks('Dark', 3, '02.01.2024') == (False, False)
+        await redis_tools.save_activation_mark('Dark', 3)
+        await redis_tools.save_punch_mark('Dark', '02.01.2024')
+        shared = await redis_tools.read_check_in_marks('Dark', 3, '02.01.2024')
+        # A row insert moved another member onto row 3
+        moved = await redis_tools.read_check_in_marks('Puk', 3, '02.01.2024')
+        return shared, moved
+
+    assert asyncio.run(run()) == ((True, True), (False, False))
+
+
+def test_own_cache_updates_are_ignored():
+    own = f"{redis_tools.CACHE_MEMBERSHIPS}:{redis_tools.WORKER_ID}".encode()
+    other = f"{redis_tools.CACHE_MEMBERSHIPS}:someone".encode()
+    assert redis_tools.parse_cache_update(own) is None
+    assert redis_tools.parse_cache_update(other) == redis_tools.CACHE_MEMBERSHIPS
+
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from kvira_space_bot_src import membership_store
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.write_queue import write_queue
+from kvira_space_bot_src.spreadsheets.data import Punches
+from fake_sheets import install_fake_sheets, make_users_sheet
+
+ROWS = [
+    {'tg_nickname': 'Dark', 'pass_type': '5day', 'date_activated': '', 'exparation_date': '', 'punches': ''},
+    {'tg_nickname': 'Puk', 'pass_type': '5day', 'date_activated': 'broken', 'exparation_date': '', 'punches': ''},
+]
+
+
+def test_sync_mirrors_working_memberships(monkeypatch, fake_redis):
+    sheet = make_users_sheet(ROWS)
+    install_fake_sheets(monkeypatch, sheet)
+
+    async def run():
+        assert await membership_store.get_membership('Dark') is None
+        assert await membership_store.sync_memberships()
+        sheet.calls.clear()
+        dark = await membership_store.get_membership('Dark')
+        puk = await membership_store.get_membership('Puk')
+        stranger = await membership_store.get_membership('Stranger')
+        await fake_redis.set(membership_store.MEMBERSHIP_SYNCED_AT_KEY, time.time() - 2 * membership_store.MEMBERSHIP_STALE_AFTER)
+        stale = await membership_store.get_membership('Dark')
+        return dark, puk, stranger, stale
+
+    dark, puk, stranger, stale = asyncio.run(run())
+    assert sheet.calls == []
+    assert dark.row_id == 0 and dark.activated is False
+    assert dark.membership_data['pass_type'] == '5day'
+    assert puk.row_id is None and len(puk.errors) == 1
+    assert stranger.row_id is None and stranger.errors == []
+    assert stale is None
+
+
+def test_write_through_survives_sync_and_removed_rows_are_dropped(monkeypatch, fake_redis):
+    sheet = make_users_sheet(ROWS)
+    install_fake_sheets(monkeypatch, sheet)
+
+    async def run():
+        await membership_store.sync_memberships()
+        await membership_store.record_activation('Dark', '02.01.2024')
+        await membership_store.record_punch('Dark', Punches.from_string('02.01.2024'))
+        # The queued writes are not in the sheet yet, Puk is deleted from it
+        del sheet.values[2]
+        await membership_store.sync_memberships()
+        return await membership_store.get_membership('Dark'), await fake_redis.exists('membership:Puk')
+
+    dark, puk_exists = asyncio.run(run())
+    assert dark.activated
+    assert dark.membership_data['date_activated'] == '02.01.2024'
+    assert dark.punches.count == 1
+    assert not puk_exists
+
+
+def test_changed_nicknames_detects_inserts_edits_and_deletes():
+    previous = {0: ('a', 'Dark'), 1: ('b', 'Puk'), 2: ('c', 'Old')}
+    current = {0: ('a', 'Dark'), 1: ('B', 'Puk'), 3: ('d', 'New')}
+    assert membership_store.changed_nicknames(previous, current) == {'Puk', 'Old', 'New'}
+
+
+def test_incremental_sync_writes_only_changed_rows(monkeypatch, fake_redis):
+    sheet = make_users_sheet(ROWS)
+    install_fake_sheets(monkeypatch, sheet)
+
+    async def run():
+        await membership_store.sync_memberships()
+        # Marker to see whether the unchanged row is written again
+        await fake_redis.hset('membership:Puk', 'pass_type', 'untouched')
+        sheet.values[1][1] = '10day'
+        await membership_store.sync_memberships()
+        dark = await membership_store.get_membership('Dark')
+        return dark, await fake_redis.hget('membership:Puk', 'pass_type')
+
+    dark, puk_pass_type = asyncio.run(run())
+    assert dark.membership_data['pass_type'] == '10day'
+    assert puk_pass_type == b'untouched'
+    assert sheet.calls == ['get_values', 'get_values']
+
+
+def test_sync_from_a_cached_copy_keeps_check_ins_made_after_its_download(monkeypatch, fake_redis):
+    sheet = make_users_sheet(ROWS)
+    install_fake_sheets(monkeypatch, sheet)
+
+    async def run():
+        await membership_store.sync_memberships()
+        # Queued writes keep the copy read long ago, a check-in came after that read
+        api.cached_users_snapshot().downloaded_at = time.time() - 1000
+        monkeypatch.setattr(write_queue, 'has_pending', lambda: True)
+        await membership_store.record_punch('Dark', Punches.from_string('02.01.2024'))
+        await fake_redis.hset('membership:Dark', 'changed_at', str(time.time() - 500))
+        await membership_store.sync_memberships(full=True)
+        return await membership_store.get_membership('Dark')
+
+    dark = asyncio.run(run())
+    assert sheet.calls == ['get_values']
+    assert dark.punches.count == 1
@@ -0,0 +1,54 @@
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+import pytest
+
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.metrics import Counter, Histogram
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('test_latency_seconds', "Test latency.", buckets=(0.1, 1))
+    histogram.observe(0.05, handler='start')
+    histogram.observe(0.5, handler='start')
+    histogram.observe(5, handler='start')
+
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{handler="start",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{handler="start",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{handler="start",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{handler="start"} 3' in lines
+    assert 'test_latency_seconds_sum{handler="start"} 5.55' in lines
+
+
+def test_counter_and_summary():
+    counter = Counter('test_failures_total', "Test failures.")
+    counter.inc(reason='forbidden')
+    counter.inc(2, reason='forbidden')
+
+    assert counter.get(reason='forbidden') == 3
+    assert 'test_failures_total{reason="forbidden"} 3' in metrics.render()
+    assert 'test_failures_total[forbidden]: 3' in metrics.summary()
+
+
+def test_sheets_call_counts_errors():
+    @metrics.sheets_call
+    def broken_sheet_read():
+        raise RuntimeError("quota")
+
+    with pytest.raises(RuntimeError):
+        broken_sheet_read()
+    assert metrics.sheets_call_latency.count(call='broken_sheet_read') == 1
+    assert metrics.sheets_call_errors.get(call='broken_sheet_read') == 1
+
+
+def test_redis_calls_are_counted_per_update():
+    before = metrics.redis_calls_per_update.count()
+    with metrics.track_update_redis_calls():
+        metrics.count_redis_call('get_user')
+        metrics.count_redis_call('add_user')
+    metrics.count_redis_call('get_user')
+
+    assert metrics.redis_calls_per_update.count() == before + 1
+    _, counts, total = [series for series in metrics.redis_calls_per_update.snapshot() if series[0] == ()][0]
+    assert total >= 2
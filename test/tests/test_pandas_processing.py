@@ -8,50 +8,57 @@ from kvira_space_bot_src.spreadsheets.api import (
     WorkingMembership,
     DateStorageError,
     get_days_left_from_membership,
+    build_nickname_index,
+    find_user_in_df,
+    find_working_memberships_bulk,
+    rows_from_values,
 )
 
+RECORDS = [{'tg_nickname': 'Dark',
+    'pass_type': '5day',
+    'date_activated': '1.1.2024',
+    'exparation_date': '30.1.2024',
+    'punches': '01.01.2024, 04.01.2024, 08.01.2024, 15.01.2024, 20.01.2024'},
+    {'tg_nickname': 'Puk',
+    'pass_type': '5day',
+    'date_activated': '2.1.2024',
+    'exparation_date': '2.2.2024',
+    'punches': '01.01.2024, 04.01.2024, 08.01.2024, 15.01.2024, 20.01.2024'},
+    {'tg_nickname': 'Miksolo',
+    'pass_type': '30day',
+    'date_activated': '1.7.2024',
+    'exparation_date': '1.08.2024',
+    'punches': '01.07.2024, 02.07.2024, 05.07.2024'},
+    {'tg_nickname': 'SomeDude',
+    'pass_type': '5day',
+    'date_activated': '',
+    'exparation_date': '',
+    'punches': ''},
+    {'tg_nickname': 'Puk',
+    'pass_type': '10day',
+    'date_activated': '5.7.2024',
+    'exparation_date': '5.08.2024',
+    'punches': ''},
+    {'tg_nickname': 'TravelFan123',
+    'pass_type': '5day',
+    'date_activated': '3.7.2024',
+    'exparation_date': '3.08.2024',
+    'punches': '03.15.2024, 03.18.2024, 03.20.2024'},
+    {'tg_nickname': 'Wanderlust',
+    'pass_type': '10day',
+    'date_activated': '6.6.2024',
+    'exparation_date': '',
+    'punches': '6.06.2024, 7.06.2024, 8.06.2024'},
+    {'tg_nickname': 'ErrorSample',
+    'pass_type': '2day',
+    'date_activated': 1.1,
+    'exparation_date': '',
+    'punches': '1,1'}]
+
+
 def test_get_current_membership():
     
-    records = [{'tg_nickname': 'Dark',
-        'pass_type': '5day',
-        'date_activated': '1.1.2024',
-        'exparation_date': '30.1.2024',
-        'punches': '01.01.2024, 04.01.2024, 08.01.2024, 15.01.2024, 20.01.2024'},
-        {'tg_nickname': 'Puk',
-        'pass_type': '5day',
-        'date_activated': '2.1.2024',
-        'exparation_date': '2.2.2024',
-        'punches': '01.01.2024, 04.01.2024, 08.01.2024, 15.01.2024, 20.01.2024'},
-        {'tg_nickname': 'Miksolo',
-        'pass_type': '30day',
-        'date_activated': '1.7.2024',
-        'exparation_date': '1.08.2024',
-        'punches': '01.07.2024, 02.07.2024, 05.07.2024'},
-        {'tg_nickname': 'SomeDude',
-        'pass_type': '5day',
-        'date_activated': '',
-        'exparation_date': '',
-        'punches': ''},
-        {'tg_nickname': 'Puk',
-        'pass_type': '10day',
-        'date_activated': '5.7.2024',
-        'exparation_date': '5.08.2024',
-        'punches': ''},
-        {'tg_nickname': 'TravelFan123',
-        'pass_type': '5day',
-        'date_activated': '3.7.2024',
-        'exparation_date': '3.08.2024',
-        'punches': '03.15.2024, 03.18.2024, 03.20.2024'},
-        {'tg_nickname': 'Wanderlust',
-        'pass_type': '10day',
-        'date_activated': '6.6.2024',
-        'exparation_date': '',
-        'punches': '6.06.2024, 7.06.2024, 8.06.2024'},
-        {'tg_nickname': 'ErrorSample',
-        'pass_type': '2day',
-        'date_activated': 1.1,
-        'exparation_date': '',
-        'punches': '1,1'}]
+    records = RECORDS
     
     df = pd.DataFrame(records)
     
@@ -115,4 +122,55 @@ def test_get_days_left_from_membership():
 
 
 def test_values_to_pandas_conversion():
-    pass
\ No newline at end of file
+    pass
+
+def test_nickname_index_lookup():
+    df = pd.DataFrame([
+        {'tg_nickname': 'Puk', 'pass_type': '5day', 'date_activated': '2.1.2024', 'exparation_date': '', 'punches': ''},
+        {'tg_nickname': 'Dark', 'pass_type': '5day', 'date_activated': '', 'exparation_date': '', 'punches': ''},
+        {'tg_nickname': 'Puk', 'pass_type': '10day', 'date_activated': '', 'exparation_date': '', 'punches': ''},
+    ], index=[10, 11, 12])
+    index = build_nickname_index(df)
+    assert index.positions == {'Puk': [0, 2], 'Dark': [1]}
+    assert list(find_user_in_df('Puk', df, index=index).index) == [10, 12]
+    assert len(find_user_in_df('Nobody', df, index=index)) == 0
+
+    res = find_working_membership('Puk', df, current_date='06.06.2024', index=index)
+    assert res.row_id == 12
+    assert res.membership_data['pass_type'] == '10day'
+
+
+def test_bulk_working_memberships_match_single_user_lookup():
+    df = pd.DataFrame(RECORDS)
+    rows = build_nickname_index(df).rows
+    for current_date in ['05.06.2024', '06.06.2024', '10.07.2024', '01.01.2025']:
+        bulk = find_working_memberships_bulk(rows, current_date=current_date)
+        assert set(bulk) == set(df['tg_nickname'])
+        for nickname in df['tg_nickname'].unique():
+            single = find_working_membership(nickname, df, current_date=current_date)
+            found = bulk[nickname]
+            assert found.row_id == single.row_id, f"{nickname} on {current_date}"
+            assert found.activated == single.activated
+            assert len(found.errors) == len(single.errors)
+            if single.activated:
+                assert get_days_left_from_membership(found) == get_days_left_from_membership(single)
+
+
+def test_rows_from_sheet_values_without_pandas():
+    values = [
+        ['tg_nickname', 'pass_type', 'date_activated', 'exparation_date', 'punches'],
+        ['Dark', '5day', '1.1.2024', '', '01.01.2024, 02.01.2024'],
+        ['', '5day'],
+        ['Puk', '10day'],
+    ]
+    rows = rows_from_values(values)
+    assert [row.row_id for row in rows] == [0, 2]
+    assert rows[0]['punches'] == '01.01.2024, 02.01.2024' and rows[0].punches.count == 2
+    assert dict(rows[1]) == {'tg_nickname': 'Puk', 'pass_type': '10day', 'date_activated': '', 'exparation_date': '', 'punches': ''}
+
+    res = find_working_membership('Puk', rows, current_date='06.06.2024')
+    assert res.row_id == 2 and res.activated is False
+    assert res.membership_data is rows[1]
+    # Changed rows are copies, the membership keeps what it was found with
+    changed = rows[1].replace(date_activated='06.06.2024')
+    assert changed.date_activated == '06.06.2024' and res.membership_data['date_activated'] == ''
@@ -1,6 +1,8 @@
 import unittest
+from datetime import date
 
 from kvira_space_bot_src.spreadsheets.api import process_punches_from_string
+from kvira_space_bot_src.spreadsheets.data import Punches
 
 class TestProcessPunchesFromString(unittest.TestCase):
     
@@ -25,5 +27,32 @@ class TestProcessPunchesFromString(unittest.TestCase):
     def test_no_punches(self):
         self.assertEqual(process_punches_from_string('No punches here!'), ['No punches here!'])
 
+class TestPunches(unittest.TestCase):
+
+    def test_empty(self):
+        for raw in ['', ' ', None]:
+            punches = Punches.from_string(raw)
+            self.assertEqual(punches.count, 0)
+            self.assertIsNone(punches.last)
+
+    def test_parsed_days(self):
+        punches = Punches.from_string('7.06.2024,  6.06.2024 ')
+        self.assertEqual(punches.count, 2)
+        self.assertEqual(punches.last, date(2024, 6, 7))
+        self.assertTrue(punches.has_day(date(2024, 6, 6)))
+        self.assertFalse(punches.has_day(date(2024, 6, 8)))
+
+    def test_invalid_tokens_are_counted(self):
+        punches = Punches.from_string('03.15.2024, 03.18.2024, 1.07.2024')
+        self.assertEqual(punches.count, 3)
+        self.assertEqual(punches.last, date(2024, 7, 1))
+
+    def test_with_day_keeps_sheet_format(self):
+        punches = Punches.from_string('6.06.2024').with_day('07.06.2024')
+        self.assertEqual(punches.to_string(), '6.06.2024, 07.06.2024')
+        self.assertEqual(punches.count, 2)
+        self.assertTrue(punches.has_day(date(2024, 6, 7)))
+        self.assertEqual(Punches.from_string('').with_day(date(2024, 6, 7)).to_string(), '07.06.2024')
+
 if __name__ == '__main__':
     unittest.main()
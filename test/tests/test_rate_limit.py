@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from kvira_space_bot_src import messaging
+from kvira_space_bot_src.rate_limit import TokenBucket, TelegramRateLimiter
+
+
+def test_token_bucket_allows_burst_then_throttles():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    # Two tokens are there from the start, two more take 1/20 s each
+    assert 0.08 <= elapsed < 0.5
+
+
+class FloodedBot:
+    def __init__(self, floods: int):
+        self.floods = floods
+        self.sent = []
+
+    async def send_message(self, chat_id, text, disable_notification=False):
+        if self.floods > 0:
+            self.floods -= 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", retry_after=0)
+        self.sent.append((chat_id, text))
+
+
+def test_send_message_retries_after_flood_control(monkeypatch):
+    monkeypatch.setattr(messaging, 'telegram_limiter', TelegramRateLimiter(global_rate=1000, per_chat_rate=1000))
+    bot = FloodedBot(floods=2)
+    assert asyncio.run(messaging.send_message_to_user(1, "hi", bot=bot))
+    assert bot.sent == [(1, "hi")]
+
+    sleep = asyncio.sleep
+    sleeps = []
+
+    async def recording_sleep(delay):
+        sleeps.append(delay)
+        await sleep(delay)
+
+    monkeypatch.setattr(asyncio, 'sleep', recording_sleep)
+    bot = FloodedBot(floods=messaging.TELEGRAM_SEND_RETRIES + 1)
+    assert not asyncio.run(messaging.send_message_to_user(1, "hi", bot=bot))
+    assert bot.sent == []
+    # No sleep after the last attempt
+    assert len(sleeps) == messaging.TELEGRAM_SEND_RETRIES
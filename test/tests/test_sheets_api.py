@@ -0,0 +1,139 @@
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+import gspread
+import pytest
+import requests
+
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.data import Lang
+from fake_sheets import FakeWorksheet, install_fake_sheets, make_texts_sheet, make_users_sheet
+
+ROWS = [
+    {'tg_nickname': 'Dark', 'pass_type': '5day', 'date_activated': '1.1.2024', 'exparation_date': '', 'punches': '01.01.2024'},
+    {'tg_nickname': 'Puk', 'pass_type': '10day', 'date_activated': '', 'exparation_date': '', 'punches': ''},
+]
+TEXTS = {
+    'hello_msg': {'eng': 'Hello', 'rus': 'Привет'},
+    'no_pass': {'eng': 'No pass', 'rus': 'Нет абонемента'},
+}
+
+
+def test_user_data_from_sheet(monkeypatch):
+    install_fake_sheets(monkeypatch, make_users_sheet(ROWS))
+    df = api.get_user_data_pandas()
+    assert list(df['tg_nickname']) == ['Dark', 'Puk']
+    membership = api.find_working_membership('Puk', df, current_date='02.01.2024')
+    assert membership.row_id == 1
+    assert membership.activated is False
+    assert api.check_if_user_exists('Dark')
+    assert not api.check_if_user_exists('Nobody')
+
+
+def test_all_text_json(monkeypatch):
+    install_fake_sheets(monkeypatch, make_texts_sheet(TEXTS))
+    texts = api.get_all_text_json()
+    assert texts['hello_msg'][Lang.Eng.value] == 'Hello'
+
+
+class FakeSpreadsheet:
+    """Resolves worksheets by title, in the order they were given for every title."""
+
+    def __init__(self, *sheets: FakeWorksheet):
+        self.sheets = list(sheets)
+        self.lookups = []
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.lookups.append(title)
+        for sheet in self.sheets:
+            if sheet.title == title:
+                self.sheets.remove(sheet)
+                return sheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+
+class FakeClient:
+    def __init__(self, table: FakeSpreadsheet):
+        self.table = table
+        self.opened = 0
+
+    def set_timeout(self, timeout) -> None:
+        pass
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.opened += 1
+        return self.table
+
+
+def _install_fake_client(monkeypatch, *sheets: FakeWorksheet) -> tuple[FakeClient, list]:
+    """Make get_gc build a client over the given worksheets, with empty handle caches."""
+    client = FakeClient(FakeSpreadsheet(*sheets))
+    created = []
+
+    def service_account(filename):
+        created.append(filename)
+        return client
+
+    monkeypatch.setattr(gspread, 'service_account', service_account)
+    monkeypatch.setattr(api, 'GOOGLE_KEY_FILE_PATH', 'key.json', raising=False)
+    monkeypatch.setattr(api, 'GOOGLE_DOC_ID', 'doc', raising=False)
+    monkeypatch.setattr(api, '_gc', None)
+    monkeypatch.setattr(api, '_table', None)
+    monkeypatch.setattr(api, '_worksheets', dict())
+    return client, created
+
+
+def _api_error(code: int) -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = code
+    response._content = f'{{"error": {{"code": {code}, "message": "error {code}", "status": "ERROR"}}}}'.encode()
+    return gspread.exceptions.APIError(response)
+
+
+def test_client_and_worksheet_handles_are_reused(monkeypatch):
+    client, created = _install_fake_client(monkeypatch, make_users_sheet(ROWS), make_texts_sheet(TEXTS))
+    for _ in range(3):
+        api.with_worksheet(api.USERS_SHEET_NAME, lambda sheet: sheet.get_values())
+        api.with_worksheet(api.TEXTS_SHEET_NAME, lambda sheet: sheet.get_values())
+    assert created == ['key.json']
+    assert client.opened == 1
+    assert client.table.lookups == [api.USERS_SHEET_NAME, api.TEXTS_SHEET_NAME]
+
+
+def test_stale_worksheet_is_resolved_again(monkeypatch):
+    stale = make_users_sheet(ROWS)
+    fresh = make_users_sheet(ROWS[:1])
+    client, _ = _install_fake_client(monkeypatch, stale, fresh)
+    api.get_worksheet(api.USERS_SHEET_NAME)
+
+    def read(sheet):
+        if sheet is stale:
+            raise _api_error(404)
+        return sheet.get_values()
+
+    assert len(api.with_worksheet(api.USERS_SHEET_NAME, read)) == 2
+    assert client.table.lookups == [api.USERS_SHEET_NAME] * 2
+    # The new handle is kept for the next calls
+    assert api.get_worksheet(api.USERS_SHEET_NAME) is fresh
+
+
+def test_other_api_errors_are_not_retried(monkeypatch):
+    client, _ = _install_fake_client(monkeypatch, make_users_sheet(ROWS))
+    calls = []
+
+    def read(sheet):
+        calls.append(sheet)
+        raise _api_error(500)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        api.with_worksheet(api.USERS_SHEET_NAME, read)
+    assert len(calls) == 1
+    assert client.table.lookups == [api.USERS_SHEET_NAME]
+
+
+def test_missing_worksheet_raises_worksheet_not_found(monkeypatch):
+    _install_fake_client(monkeypatch, make_texts_sheet(TEXTS))
+    calls = []
+    with pytest.raises(gspread.exceptions.WorksheetNotFound):
+        api.with_worksheet(api.USERS_SHEET_NAME, calls.append)
+    assert calls == []
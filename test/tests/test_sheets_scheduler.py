@@ -0,0 +1,97 @@
+import asyncio
+
+import gspread
+import pytest
+import requests
+
+from kvira_space_bot_src import metrics
+from kvira_space_bot_src.spreadsheets.scheduler import (
+    SheetsScheduler,
+    PRIORITY_BACKGROUND,
+    PRIORITY_READ,
+    PRIORITY_WRITE,
+)
+
+
+def api_error(code: int) -> gspread.exceptions.APIError:
+    response = requests.Response()
+    response.status_code = code
+    response._content = f'{{"error": {{"code": {code}, "message": "error {code}", "status": "ERROR"}}}}'.encode()
+    return gspread.exceptions.APIError(response)
+
+
+def test_writes_are_served_before_background_reads():
+    scheduler = SheetsScheduler(requests_per_minute=600, burst=1)
+    order = []
+
+    async def call(name, priority):
+        await scheduler.acquire(priority)
+        order.append(name)
+
+    async def run():
+        # The first call takes the only token, the rest queue up
+        await scheduler.acquire(PRIORITY_READ)
+        await asyncio.gather(
+            call('sync', PRIORITY_BACKGROUND),
+            call('reload', PRIORITY_READ),
+            call('punch', PRIORITY_WRITE),
+        )
+
+    asyncio.run(run())
+    assert order == ['punch', 'reload', 'sync']
+    assert metrics.sheets_queue_depth.get() == 0
+
+
+def test_quota_errors_are_retried_with_backoff():
+    scheduler = SheetsScheduler(requests_per_minute=6000, backoff_base=0.01, max_retries=3)
+    attempts = []
+
+    def flaky_read():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise api_error(429)
+        return 'rows'
+
+    assert asyncio.run(scheduler.call(flaky_read)) == 'rows'
+    assert len(attempts) == 3
+    assert metrics.sheets_retries.get(call='flaky_read') == 2
+
+
+def test_other_errors_and_exhausted_retries_are_raised():
+    scheduler = SheetsScheduler(requests_per_minute=6000, backoff_base=0.01, max_retries=1)
+    attempts = []
+
+    def broken(code):
+        attempts.append(code)
+        raise api_error(code)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        asyncio.run(scheduler.call(broken, 403))
+    with pytest.raises(gspread.exceptions.APIError):
+        asyncio.run(scheduler.call(broken, 503))
+    assert attempts == [403, 503, 503]
+
+
+def test_cost_above_burst_does_not_wait_forever():
+    scheduler = SheetsScheduler(requests_per_minute=6000, burst=2)
+
+    async def run():
+        await scheduler.acquire(PRIORITY_WRITE, cost=2)
+        await asyncio.wait_for(scheduler.acquire(PRIORITY_WRITE, cost=5), 1)
+
+    asyncio.run(run())
+
+
+def test_workers_share_the_quota_through_redis(fake_redis):
+    first = SheetsScheduler(requests_per_minute=60, burst=2, quota_key='sheets_quota')
+    second = SheetsScheduler(requests_per_minute=60, burst=2, quota_key='sheets_quota')
+
+    async def run():
+        assert await first.acquire(PRIORITY_READ) == 0
+        assert await second.acquire(PRIORITY_READ) == 0
+        # The burst is used up by the two workers together
+        return await second._take(1), await fake_redis.exists('sheets_quota')
+
+    wait, bucket_exists = asyncio.run(run())
+    assert 0 < wait <= 1
+    assert bucket_exists
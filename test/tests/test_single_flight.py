@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from kvira_space_bot_src.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_load():
+    flight = SingleFlight()
+    loads = []
+
+    async def load(name):
+        loads.append(name)
+        await asyncio.sleep(0.01)
+        return len(loads)
+
+    async def run():
+        shared = await asyncio.gather(*(flight.do('users', load, 'shared') for _ in range(20)))
+        # After a write the caller wants a download that starts after it
+        fresh, joined = await asyncio.gather(
+            flight.do('users', load, 'fresh', fresh=True),
+            flight.do('users', load, 'joined'),
+        )
+        return shared, fresh, joined
+
+    shared, fresh, joined = asyncio.run(run())
+    assert shared == [1] * 20
+    assert fresh == joined == 2
+    assert loads == ['shared', 'fresh']
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    flight = SingleFlight()
+    calls = []
+
+    async def broken():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("quota")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do('texts', broken) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do('texts', broken)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 2
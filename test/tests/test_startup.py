@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import requests
+
+from kvira_space_bot_src import messaging, startup
+from kvira_space_bot_src.spreadsheets import api, async_api
+from kvira_space_bot_src.spreadsheets.data import Lang, MembershipRow
+from fake_sheets import install_fake_sheets, make_texts_sheet, make_users_sheet
+
+TEXTS = {'hello_msg': {'msg_type': 'hello_msg', 'eng': 'Hello', 'rus': 'Привет'}}
+ROWS = [MembershipRow(0, 'Dark', '5day', '', '', ''), MembershipRow(2, 'Puk', '10day', '1.1.2024', '', '01.01.2024')]
+
+
+def test_local_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshots' / 'kvira_snapshot.json')
+    assert startup.read_local_snapshot(path) is None
+    startup.save_local_snapshot(TEXTS, ROWS, path)
+    texts, rows, downloaded_at = startup.read_local_snapshot(path)
+    assert texts == TEXTS
+    assert rows == ROWS and rows[1].punches.count == 1
+    assert time.time() - downloaded_at < 60
+
+
+def test_cold_start_serves_local_snapshot_without_google(monkeypatch, tmp_path, fake_redis):
+    path = str(tmp_path / 'kvira_snapshot.json')
+    startup.save_local_snapshot(TEXTS, ROWS, path)
+    monkeypatch.setattr(startup, 'LOCAL_SNAPSHOT_PATH', path)
+    users_sheet = make_users_sheet([])
+    texts_sheet = make_texts_sheet({'hello_msg': {'eng': 'Hello again', 'rus': 'Снова привет'}})
+    install_fake_sheets(monkeypatch, users_sheet, texts_sheet)
+    messaging.set_text_catalog(dict())
+
+    async def run():
+        # Redis has no text catalog yet, so it comes from the file
+        await startup.restore_last_known_state()
+        restored = messaging.get_message_for_user('hello_msg', Lang.Eng)
+        assert users_sheet.calls == [] and texts_sheet.calls == []
+        await startup.refresh_from_sheets()
+        return restored
+
+    restored = asyncio.run(run())
+    assert restored == 'Hello'
+    assert api.get_snapshot_membership(2).membership_data['tg_nickname'] == 'Puk'
+    assert messaging.get_message_for_user('hello_msg', Lang.Eng) == 'Hello again'
+    texts, _, _ = startup.read_local_snapshot(path)
+    assert texts['hello_msg']['eng'] == 'Hello again'
+    api.invalidate_users_snapshot()
+
+
+def test_old_local_snapshot_is_refreshed_and_served_while_google_is_down(monkeypatch, tmp_path, fake_redis, sheets_scheduler):
+    path = str(tmp_path / 'kvira_snapshot.json')
+    downloaded_at = time.time() - 3 * 24 * 3600
+    startup.save_local_snapshot(TEXTS, ROWS, path, downloaded_at)
+    monkeypatch.setattr(startup, 'LOCAL_SNAPSHOT_PATH', path)
+    users_sheet = make_users_sheet([{'tg_nickname': 'Miksolo', 'pass_type': '5day', 'date_activated': '', 'exparation_date': '', 'punches': ''}])
+    install_fake_sheets(monkeypatch, users_sheet, make_texts_sheet({}))
+    monkeypatch.setattr(sheets_scheduler, 'backoff', lambda attempt: 0)
+
+    get_user_rows = api.get_user_rows
+
+    def down():
+        raise requests.exceptions.ConnectionError("Google is down")
+
+    async def run():
+        await startup.restore_last_known_state()
+        # The file is days old, it counts as expired but is served while Google is down
+        assert api.cached_users_snapshot() is None
+        monkeypatch.setattr(api, 'get_user_rows', down)
+        served = await async_api.get_users_snapshot()
+        assert api.get_user_data_cached() == ROWS
+        await startup.save_local_snapshot_now()
+        monkeypatch.setattr(api, 'get_user_rows', get_user_rows)
+        return served, await async_api.get_users_snapshot()
+
+    try:
+        served, refreshed = asyncio.run(run())
+    finally:
+        api.invalidate_users_snapshot()
+    assert served.downloaded_at == downloaded_at and served.rows == ROWS
+    # Saving again keeps the age of the rows
+    assert startup.read_local_snapshot(path)[2] == downloaded_at
+    assert [row.tg_nickname for row in refreshed.rows] == ['Miksolo']
+    assert refreshed.downloaded_at > downloaded_at
@@ -0,0 +1,96 @@
+import asyncio
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForTestsOnly000000000000')
+
+import pytest
+
+from kvira_space_bot_src import bot as bot_module
+from kvira_space_bot_src import messaging, metrics, redis_tools
+from fake_sheets import install_fake_sheets, make_texts_sheet
+from fake_telegram import RecordingSession, make_message
+
+TEXTS = {'hello_msg': {'eng': 'Hello', 'rus': 'Привет'}}
+NEW_TEXTS = {'hello_msg': {'eng': 'Hi', 'rus': 'Привет'}, 'no_pass': {'eng': 'No pass', 'rus': 'Нет абонемента'}}
+
+
+@pytest.fixture
+def empty_catalog(monkeypatch):
+    """Start with an empty in-process catalog and restore the old one afterwards."""
+    monkeypatch.setattr(messaging, '_text_catalog', dict())
+    monkeypatch.setattr(messaging, '_text_catalog_version', None)
+
+
+def test_catalog_is_only_transferred_when_its_version_changes(fake_redis, empty_catalog):
+    def transfers() -> float:
+        return metrics.redis_calls.get(operation='read_text_catalog')
+
+    async def run():
+        # Published by another worker
+        await redis_tools.save_text_catalog_to_redis(TEXTS)
+        before = transfers()
+        loaded = [await messaging.load_text_catalog()]
+        loaded.append(await messaging.load_text_catalog())
+        unchanged = messaging.get_text_catalog()
+        await redis_tools.save_text_catalog_to_redis(NEW_TEXTS)
+        loaded.append(await messaging.load_text_catalog())
+        return loaded, unchanged, transfers() - before
+
+    loaded, unchanged, transferred = asyncio.run(run())
+    assert loaded == [True, False, True]
+    assert unchanged == TEXTS
+    assert messaging.get_text_catalog() == NEW_TEXTS
+    assert messaging._text_catalog_version == 2
+    # The check in between costs only the version GET
+    assert transferred == 2
+
+
+def test_reload_texts_publishes_the_sheet_to_all_workers(monkeypatch, fake_redis, empty_catalog):
+    install_fake_sheets(monkeypatch, make_texts_sheet(NEW_TEXTS))
+    session = RecordingSession()
+    monkeypatch.setattr(bot_module.bot, 'session', session)
+
+    async def run():
+        pubsub = fake_redis.pubsub()
+        await pubsub.subscribe(redis_tools.CACHE_UPDATES_CHANNEL)
+        await pubsub.get_message(timeout=1)
+        message = make_message(bot_module.bot, 1, 7, 'Admin', '/reload_texts')
+        await bot_module.TelegramApiBot.reload_texts_command_handler(message)
+        announcement = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+        await pubsub.aclose()
+        # A worker holding the old version takes the new catalog
+        other_worker = await redis_tools.read_text_catalog_from_redis(known_version=0)
+        return announcement, other_worker
+
+    announcement, other_worker = asyncio.run(run())
+    assert announcement['data'] == f"{redis_tools.CACHE_TEXTS}:{redis_tools.WORKER_ID}".encode()
+    version, texts = other_worker
+    assert version == 1 and texts['hello_msg']['eng'] == 'Hi'
+    assert messaging.get_text_catalog() == texts
+    assert session.sent[7] == ["Texts reloaded: 2 messages, version 1."]
+
+
+def test_text_version_is_checked_while_updates_keep_coming(monkeypatch, fake_redis):
+    checks = []
+
+    async def load_text_catalog():
+        checks.append(1)
+        if len(checks) == 2:
+            # Stop the listener
+            raise asyncio.CancelledError()
+        return True
+
+    monkeypatch.setattr(messaging, 'TEXT_VERSION_CHECK_INTERVAL', 0.2)
+    monkeypatch.setattr(messaging, 'load_text_catalog', load_text_catalog)
+
+    async def run():
+        listener = asyncio.create_task(messaging.cache_updates_listener())
+        # Announcements arrive more often than the check interval
+        while not listener.done():
+            await asyncio.sleep(0.05)
+            await fake_redis.publish(redis_tools.CACHE_UPDATES_CHANNEL, f"{redis_tools.CACHE_MEMBERSHIPS}:someone")
+        with pytest.raises(asyncio.CancelledError):
+            await listener
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(checks) == 2
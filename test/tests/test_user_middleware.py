@@ -0,0 +1,70 @@
+import asyncio
+import os
+from datetime import datetime
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForTestsOnly000000000000')
+
+from aiogram.types import Chat, Message, User
+
+from kvira_space_bot_src import bot as bot_module
+from kvira_space_bot_src import metrics, redis_tools
+from kvira_space_bot_src.spreadsheets.data import Lang
+
+
+def _message(user_id: int, from_user: User | None = None) -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type='private'),
+        from_user=from_user or User(id=user_id, is_bot=False, first_name='Member', username='Dark'),
+        text='hi',
+    )
+
+
+def test_profile_is_loaded_or_created_once_per_message(fake_redis):
+    middleware = bot_module.UserMiddleware()
+    seen = []
+
+    async def handler(event, data):
+        seen.append(data['user'])
+
+    def redis_calls() -> float:
+        return sum(value for _, value in metrics.redis_calls.snapshot())
+
+    async def run():
+        calls = [redis_calls()]
+        for _ in range(2):
+            await middleware(handler, _message(42), {})
+            calls.append(redis_calls())
+        return await redis_tools.redis_user_db.hgetall('user:42'), calls
+
+    stored, calls = asyncio.run(run())
+    assert seen[0] == seen[1]
+    assert seen[0].user_id == '42' and seen[0].lang == Lang.Rus
+    assert stored[b'username'] == b'Dark'
+    # One lookup and the creation, then the profile comes from the cache
+    assert calls[1] - calls[0] == 2
+    assert calls[2] - calls[1] == 0
+
+
+def test_messages_without_a_user_sender_do_not_reach_the_handlers(fake_redis):
+    middleware = bot_module.UserMiddleware()
+    seen = []
+
+    async def handler(event, data):
+        seen.append(data['user'])
+
+    async def run():
+        without_sender = _message(42).model_copy(update={'from_user': None})
+        await middleware(handler, without_sender, {})
+        await middleware(handler, _message(42, User(id=7, is_bot=True, first_name='Bot')), {})
+        return await redis_tools.redis_user_db.keys('*')
+
+    assert asyncio.run(run()) == []
+    assert seen == []
+
+
+def test_keyboards_are_prebuilt_per_language():
+    assert bot_module.get_keyboard(Lang.Eng) is bot_module.get_keyboard(Lang.Eng)
+    assert bot_module.get_keyboard(Lang.Rus).keyboard[0][0].text == bot_module.buttons[Lang.Rus.value]['check_membership']
+    assert bot_module.get_keyboard(Lang.Eng).keyboard[0][1].text == bot_module.buttons[Lang.Eng.value]['check_in']
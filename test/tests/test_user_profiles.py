@@ -0,0 +1,90 @@
+import asyncio
+
+from kvira_space_bot_src import messaging, metrics, redis_tools
+from kvira_space_bot_src.redis_tools import TelegramUser, UserCache
+from kvira_space_bot_src.spreadsheets.data import Lang
+
+
+def _redis_calls() -> float:
+    return sum(value for _, value in metrics.redis_calls.snapshot())
+
+
+def test_profiles_are_hashes_served_from_the_cache(fake_redis):
+    user = TelegramUser(user_id='42', username='Dark', lang=Lang.Rus)
+
+    async def run():
+        await redis_tools.add_user_to_redis(user)
+        stored = await redis_tools.redis_user_db.hgetall('user:42')
+        calls = _redis_calls()
+        cached = await redis_tools.get_user_from_redis(42)
+        return stored, cached, _redis_calls() - calls
+
+    stored, cached, calls = asyncio.run(run())
+    assert stored == {b'user_id': b'42', b'username': b'Dark', b'lang': b'rus'}
+    assert cached == user
+    assert calls == 0
+
+
+def test_legacy_json_profiles_are_read_and_moved_to_hashes(fake_redis):
+    users = [TelegramUser(user_id='7', username='Puk', lang=Lang.Eng), TelegramUser(user_id='8', username='Miksolo', lang=Lang.Rus)]
+
+    async def run():
+        for user in users:
+            await redis_tools.redis_user_db.set(user.user_id, user.model_dump_json())
+            await redis_tools.redis_user_db.sadd(redis_tools.ALL_USERS_KEY_LIST, user.user_id)
+        loaded = await redis_tools.get_user_from_redis('7')
+        scanned = [user async for batch in redis_tools.scan_users() for user in batch]
+        return loaded, await redis_tools.redis_user_db.exists('7'), scanned
+
+    loaded, legacy_exists, scanned = asyncio.run(run())
+    assert loaded == users[0]
+    assert not legacy_exists
+    assert sorted(scanned, key=lambda user: user.user_id) == users
+
+
+def test_lang_change_writes_one_field_and_other_workers_forget_the_profile(fake_redis):
+    user = TelegramUser(user_id='42', username='Dark', lang=Lang.Rus)
+
+    async def run():
+        await redis_tools.add_user_to_redis(user)
+        await redis_tools.redis_user_db.hset('user:42', 'username', 'marker')
+        updated = await redis_tools.update_user_lang_in_redis('42', Lang.Eng)
+        return updated, await redis_tools.redis_user_db.hgetall('user:42')
+
+    updated, stored = asyncio.run(run())
+    assert updated.lang == Lang.Eng and user.lang == Lang.Rus
+    assert stored[b'lang'] == b'eng' and stored[b'username'] == b'marker'
+
+    messaging.apply_cache_update(f"{redis_tools.CACHE_USERS}/42")
+    assert redis_tools.user_cache.get('42') is None
+
+
+def test_lang_change_writes_the_whole_profile_if_its_hash_is_gone(fake_redis):
+    user = TelegramUser(user_id='42', username='Dark', lang=Lang.Rus)
+
+    async def run():
+        await redis_tools.add_user_to_redis(user)
+        # Redis was flushed, this worker still has the profile cached
+        await redis_tools.redis_user_db.flushall()
+        await redis_tools.update_user_lang_in_redis('42', Lang.Eng)
+        return (
+            await redis_tools.redis_user_db.hgetall('user:42'),
+            await redis_tools.redis_user_db.sismember(redis_tools.ALL_USERS_KEY_LIST, '42'),
+        )
+
+    stored, listed = asyncio.run(run())
+    assert stored == {b'user_id': b'42', b'username': b'Dark', b'lang': b'eng'}
+    assert listed
+
+
+def test_user_cache_is_bounded_and_expires(monkeypatch):
+    cache = UserCache(size=2, ttl=60)
+    users = [TelegramUser(user_id=str(i), username=f"user{i}", lang=Lang.Rus) for i in range(3)]
+    for user in users:
+        cache.put(user)
+    assert len(cache) == 2 and cache.get('0') is None
+    now = [1000.0]
+    monkeypatch.setattr(redis_tools.time, 'monotonic', lambda: now[0])
+    cache.put(users[0])
+    now[0] += 61
+    assert cache.get('0') is None
@@ -0,0 +1,45 @@
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets.data import MembershipRow
+
+
+def _patch_loader(monkeypatch):
+    calls = []
+
+    def fake_loader():
+        calls.append(1)
+        return [MembershipRow(0, 'Dark')]
+
+    monkeypatch.setattr(api, 'get_user_rows', fake_loader)
+    api.invalidate_users_snapshot()
+    return calls
+
+
+def test_snapshot_is_reused_within_ttl(monkeypatch):
+    calls = _patch_loader(monkeypatch)
+    monkeypatch.setattr(api, 'USERS_CACHE_TTL', 60)
+    first = api.get_user_data_cached()
+    second = api.get_user_data_cached()
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_snapshot_expires_after_ttl(monkeypatch):
+    calls = _patch_loader(monkeypatch)
+    monkeypatch.setattr(api, 'USERS_CACHE_TTL', 0)
+    api.get_user_data_cached()
+    api.get_user_data_cached()
+    assert len(calls) == 2
+
+
+def test_snapshot_force_refresh_and_invalidation(monkeypatch):
+    calls = _patch_loader(monkeypatch)
+    monkeypatch.setattr(api, 'USERS_CACHE_TTL', 60)
+    api.get_user_data_cached()
+    api.get_user_data_cached(force_refresh=True)
+    assert len(calls) == 2
+    api.invalidate_users_snapshot()
+    api.get_user_data_cached()
+    assert len(calls) == 3
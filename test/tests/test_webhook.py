@@ -0,0 +1,45 @@
+import asyncio
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+os.environ.setdefault('TELEGRAM_API_KEY', '123456789:AAFakeTokenForTestsOnly000000000000')
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from kvira_space_bot_src import bot as bot_module
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Test'},
+        'text': 'no handler matches this text',
+    },
+}
+
+
+def test_webhook_checks_secret_token(monkeypatch):
+    monkeypatch.setattr(bot_module, 'WEBHOOK_SECRET', 'secret')
+    fed = []
+
+    async def feed_raw_update(bot, update, **kwargs):
+        fed.append(update['update_id'])
+
+    monkeypatch.setattr(bot_module.dp, 'feed_raw_update', feed_raw_update)
+
+    async def run():
+        app = bot_module.build_webhook_app(bot_module.bot)
+        async with TestClient(TestServer(app)) as client:
+            rejected = await client.post(bot_module.WEBHOOK_PATH, json=UPDATE)
+            accepted = await client.post(
+                bot_module.WEBHOOK_PATH,
+                json=UPDATE,
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'},
+            )
+            # The update is handled in a background task
+            await asyncio.sleep(0.01)
+            return rejected.status, accepted.status
+
+    assert asyncio.run(run()) == (401, 200)
+    assert fed == [1]
@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import os
+os.environ['KVIRA_BOT_TESTS_ENV'] = 'True'
+
+import pytest
+import requests
+
+from kvira_space_bot_src.locks import RedisLock
+from kvira_space_bot_src.spreadsheets import api
+from kvira_space_bot_src.spreadsheets import write_queue as write_queue_module
+from kvira_space_bot_src.spreadsheets.write_queue import SheetsWriteQueue
+from fake_sheets import install_fake_sheets, make_users_sheet
+
+
+ROWS = [
+    {'tg_nickname': 'Dark', 'pass_type': '5day', 'date_activated': '1.1.2024', 'exparation_date': '', 'punches': '01.01.2024'},
+    {'tg_nickname': 'Puk', 'pass_type': '5day', 'date_activated': '', 'exparation_date': '', 'punches': ''},
+]
+
+
+def _setup(monkeypatch):
+    sheet = make_users_sheet(ROWS)
+    install_fake_sheets(monkeypatch, sheet)
+    api.get_users_snapshot()
+    sheet.calls.clear()
+    return sheet
+
+
+def test_queued_writes_are_visible_and_flushed_in_one_batch(monkeypatch, fake_redis):
+    sheet = _setup(monkeypatch)
+    queue = SheetsWriteQueue()
+    queue.punch(0, 'Dark', '02.01.2024')
+    queue.activate(1, 'Puk', '02.01.2024')
+    queue.punch(1, 'Puk', '02.01.2024')
+    queue.punch(0, 'Dark', '03.01.2024')
+
+    assert queue.has_pending()
+    membership = api.get_snapshot_membership(0)
+    assert membership.membership_data['punches'] == '01.01.2024, 02.01.2024, 03.01.2024'
+    assert membership.punches.count == 3
+    membership = api.get_snapshot_membership(1)
+    assert membership.activated
+    assert membership.membership_data['date_activated'] == '02.01.2024'
+
+    assert asyncio.run(queue.flush())
+    assert not queue.has_pending()
+    assert sheet.calls == ['batch_get', 'batch_update']
+    assert sheet.values[1][4] == '01.01.2024, 02.01.2024, 03.01.2024'
+    assert sheet.values[2][2] == '02.01.2024'
+    assert sheet.values[2][4] == '02.01.2024'
+
+
+def test_failed_flush_keeps_order(monkeypatch, fake_redis):
+    write_pending_changes = api.write_pending_changes
+    sheet = _setup(monkeypatch)
+    queue = SheetsWriteQueue()
+    queue.punch(1, 'Puk', '02.01.2024')
+
+    def broken(changes):
+        raise RuntimeError("Sheets is down")
+
+    async def run():
+        monkeypatch.setattr(api, 'write_pending_changes', broken)
+        assert not await queue.flush()
+        queue.punch(1, 'Puk', '03.01.2024')
+        monkeypatch.setattr(api, 'write_pending_changes', write_pending_changes)
+        assert await queue.flush()
+
+    asyncio.run(run())
+    assert sheet.values[2][4] == '02.01.2024, 03.01.2024'
+
+
+def test_retried_batch_does_not_write_twice(monkeypatch, fake_redis, sheets_scheduler):
+    sheet = _setup(monkeypatch)
+    batch_update = sheet.batch_update
+    lost = []
+
+    def batch_update_losing_the_answer(data, **kwargs):
+        batch_update(data, **kwargs)
+        if not lost:
+            lost.append(1)
+            raise requests.exceptions.ConnectionError("connection reset")
+
+    monkeypatch.setattr(sheet, 'batch_update', batch_update_losing_the_answer)
+    monkeypatch.setattr(sheets_scheduler, 'backoff', lambda attempt: 0)
+    queue = SheetsWriteQueue()
+    queue.punch(0, 'Dark', '02.01.2024')
+    queue.activate(1, 'Puk', '02.01.2024')
+    # Another worker activated it meanwhile, the cell is not overwritten
+    sheet.values[2][2] = '01.01.2024'
+
+    assert asyncio.run(queue.flush())
+    assert lost
+    assert sheet.values[1][4] == '01.01.2024, 02.01.2024'
+    assert sheet.values[2][2] == '01.01.2024'
+
+
+def test_slow_flush_keeps_the_lock_and_is_not_requeued(monkeypatch, fake_redis):
+    write_pending_changes = api.write_pending_changes
+    sheet = _setup(monkeypatch)
+    monkeypatch.setattr(write_queue_module, 'SHEETS_FLUSH_TIMEOUT', 0.1)
+    held = []
+
+    def slow(changes):
+        time.sleep(0.4)
+        return write_pending_changes(changes)
+
+    async def run():
+        monkeypatch.setattr(api, 'write_pending_changes', slow)
+        queue = SheetsWriteQueue()
+        queue.punch(1, 'Puk', '02.01.2024')
+        flush = asyncio.create_task(queue.flush())
+        await asyncio.sleep(0.25)
+        # The lease is renewed while the write runs
+        held.append(await fake_redis.exists('lock:sheets_flush'))
+        assert await flush
+        return queue.has_pending(), await fake_redis.exists('lock:sheets_flush')
+
+    pending, lock_exists = asyncio.run(run())
+    assert held == [1]
+    assert not pending and not lock_exists
+    assert sheet.values[2][4] == '02.01.2024'
+
+
+def test_cancelled_flush_keeps_the_writes_and_stop_waits_for_the_running_one(monkeypatch, fake_redis):
+    sheet = _setup(monkeypatch)
+    monkeypatch.setattr(write_queue_module, 'SHEETS_FLUSH_TIMEOUT', 0.5)
+
+    async def run():
+        queue = SheetsWriteQueue(flush_interval=0.01)
+        queue.punch(1, 'Puk', '02.01.2024')
+        # Another worker is flushing, the lock is held
+        other_worker = RedisLock('sheets_flush', lease=0.3)
+        assert await other_worker.try_acquire()
+        runner = asyncio.create_task(queue.run())
+        await asyncio.sleep(0.1)
+        runner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await runner
+        cancelled_pending = queue.has_pending()
+
+        queue = SheetsWriteQueue(flush_interval=0.01)
+        queue.punch(1, 'Puk', '03.01.2024')
+        await other_worker.release()
+        other_worker = RedisLock('sheets_flush', lease=0.3)
+        assert await other_worker.try_acquire()
+        runner = asyncio.create_task(queue.run())
+        await asyncio.sleep(0.1)
+        # The running flush waits for the lock and is finished, not cancelled
+        await queue.stop()
+        return cancelled_pending, queue.has_pending(), runner.done()
+
+    cancelled_pending, pending, run_done = asyncio.run(run())
+    assert cancelled_pending
+    assert not pending and run_done
+    assert sheet.values[2][4] == '03.01.2024'
+
+
+def test_write_is_skipped_when_the_row_holds_another_member(monkeypatch, fake_redis):
+    sheet = _setup(monkeypatch)
+    queue = SheetsWriteQueue()
+    queue.punch(1, 'Puk', '02.01.2024')
+    queue.punch(0, 'Dark', '02.01.2024')
+    # A row was inserted above, Dark is in row 1 now
+    sheet.values.insert(1, ['Miksolo', '5day', '', '', ''])
+
+    assert asyncio.run(queue.flush())
+    assert not queue.has_pending()
+    assert sheet.values[2] == ['Dark', '5day', '1.1.2024', '', '01.01.2024']
+    assert sheet.values[1][4] == ''